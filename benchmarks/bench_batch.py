@@ -0,0 +1,47 @@
+""" Compare batch_query() with a loop of cflags()/libs() calls """
+
+from pypkgconf import PkgconfClient
+
+from synthetic import generate, write_report
+
+import argparse
+import random
+import tempfile
+import time
+
+
+def bench_loop(client: PkgconfClient, targets):
+    return [(client.cflags(t), client.libs(t)) for t in targets]
+
+
+def bench_batch(client: PkgconfClient, targets):
+    return client.batch_query(targets, want=('cflags', 'libs'))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--packages', type=int, default=300)
+    parser.add_argument('--fanout', type=int, default=3)
+    parser.add_argument('--targets', type=int, default=300)
+    parser.add_argument('--output', help='JSON output file, instead of stdout')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        names = generate(tmpdir, args.packages, args.fanout)
+        rng = random.Random(1)
+        targets = [rng.sample(names, 3) for _ in range(args.targets)]
+
+        results = []
+        for name, func in (('loop', bench_loop), ('batch_query', bench_batch)):
+            client = PkgconfClient(with_paths=[tmpdir])
+            start = time.perf_counter()
+            func(client, targets)
+            elapsed = time.perf_counter() - start
+            results.append({'name': name, 'total_s': elapsed, 'targets_per_s': len(targets) / elapsed})
+
+    write_report({'packages': args.packages, 'fanout': args.fanout, 'targets': args.targets, 'results': results},
+                 args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+""" Cost of creating and unpickling clients, with and without a first query """
+
+from pypkgconf import PkgconfClient
+
+from synthetic import generate, write_report
+
+import argparse
+import pickle
+import tempfile
+import time
+
+
+def bench(name: str, func, count: int):
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    elapsed = time.perf_counter() - start
+    return {'name': name, 'count': count, 'mean_s': elapsed / count}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--output', help='JSON output file, instead of stdout')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        generate(tmpdir, 10, 2)
+        state = pickle.dumps(PkgconfClient(with_paths=[tmpdir], define_variables={'prefix': '/opt'}))
+
+        results = [
+            bench('create', lambda: PkgconfClient(with_paths=[tmpdir]), args.count),
+            bench('create+query', lambda: PkgconfClient(with_paths=[tmpdir]).modversion('pkg9'), args.count),
+            bench('unpickle', lambda: pickle.loads(state), args.count),
+            bench('unpickle+query', lambda: pickle.loads(state).modversion('pkg9'), args.count),
+        ]
+
+    report = {'pickle_bytes': len(state), 'results': results}
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
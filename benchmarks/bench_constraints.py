@@ -0,0 +1,65 @@
+""" Bulk version constraint checks, against one modversion() solve per constraint """
+
+from pypkgconf import PkgconfClient
+from pypkgconf.graph import COMPARATORS
+
+from synthetic import generate, write_report
+
+import argparse
+import logging
+import random
+import tempfile
+import time
+
+
+def constraints(names, count: int, seed: int = 0):
+    rng = random.Random(seed)
+    comparators = [c for c in COMPARATORS if c]
+    result = []
+    for _ in range(count):
+        name = rng.choice(names) if rng.random() > 0.05 else 'missing'
+        result.append((name, rng.choice(comparators), rng.choice(('0.9', '1.0', '1.0.0', '1.1'))))
+    return result
+
+
+def per_call(client: PkgconfClient, checks):
+    # A solve of 'name op version' limited to the package itself, like --atleast-version
+    return [1 if client.modversion(f'{n} {c} {v}') is not None else 0 if client.modversion(n) else -1
+            for n, c, v in checks]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--packages', type=int, default=2000)
+    parser.add_argument('--constraints', type=int, default=1000)
+    parser.add_argument('--output', help='JSON output file, instead of stdout')
+    args = parser.parse_args()
+
+    # failed per-call solves are logged as errors
+    logging.getLogger('pypkgconf').setLevel(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        names = generate(tmpdir, args.packages, 3)
+        checks = constraints(names, args.constraints)
+        results = []
+        for cache in (False, True):
+            client = PkgconfClient(with_paths=[tmpdir], cache=cache)
+            start = time.perf_counter()
+            expected = per_call(client, checks)
+            per_call_s = time.perf_counter() - start
+
+            client = PkgconfClient(with_paths=[tmpdir], cache=cache)
+            start = time.perf_counter()
+            bulk = client.check_constraints(checks)
+            bulk_s = time.perf_counter() - start
+
+            assert list(bulk.results) == expected
+            results.append({'cache': cache, 'per_call_s': per_call_s, 'bulk_s': bulk_s,
+                            'speedup': per_call_s / bulk_s})
+
+    report = {'packages': args.packages, 'constraints': args.constraints, 'results': results}
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
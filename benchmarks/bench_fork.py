@@ -0,0 +1,70 @@
+""" Per-target variants of a client: variables_ctx() and options_ctx() on one
+client, against one fork per variant. Results are not memoized, so each
+variant is solved; forks only parse the packages once per prefix. """
+
+from pypkgconf import PkgconfClient
+
+from synthetic import generate, write_report
+
+import argparse
+import tempfile
+import time
+
+
+def bench(name: str, func, variants: int):
+    start = time.perf_counter()
+    results = func()
+    elapsed = time.perf_counter() - start
+    return {'name': name, 'variants': variants, 'total_s': elapsed, 'mean_s': elapsed / variants}, results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--packages', type=int, default=500)
+    parser.add_argument('--variants', type=int, default=200)
+    parser.add_argument('--output', help='JSON output file, instead of stdout')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        names = generate(tmpdir, args.packages, 3)
+        target = names[-1]
+        prefixes = [f'/opt/target{i % 4}' for i in range(args.variants)]
+
+        def with_contexts():
+            client = PkgconfClient(with_paths=[tmpdir], cache=True)
+            results = []
+            for i, prefix in enumerate(prefixes):
+                with client.variables_ctx(prefix=prefix), client.options_ctx(static=bool(i % 2)):
+                    results.append(client.libs(target))
+            return results
+
+        def with_forks():
+            client = PkgconfClient(with_paths=[tmpdir], cache=True)
+            forks = [client.fork({'prefix': prefix}, static=bool(i % 2)) for i, prefix in enumerate(prefixes)]
+            return [fork.libs(target) for fork in forks]
+
+        def create_forks():
+            client = PkgconfClient(with_paths=[tmpdir], cache=True)
+            return [client.fork({'prefix': prefix}, static=bool(i % 2)) for i, prefix in enumerate(prefixes)]
+
+        def static_toggle():
+            client = PkgconfClient(with_paths=[tmpdir], cache=True)
+            results = []
+            for i in range(args.variants):
+                with client.options_ctx(static=bool(i % 2)):
+                    results.append(client.libs(target))
+            return results
+
+        contexts, expected = bench('variables_ctx+options_ctx', with_contexts, args.variants)
+        forks, results = bench('fork', with_forks, args.variants)
+        toggle, _ = bench('options_ctx static toggle', static_toggle, args.variants)
+        create, _ = bench('fork creation', create_forks, args.variants)
+        if results != expected:
+            raise RuntimeError('forks do not match the contexts')
+
+    report = {'packages': args.packages, 'results': [contexts, forks, toggle, create]}
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+""" Cold resolution over a long search path, with and without the package index
+
+libpkgconf tries each directory of the search path in turn: a package found
+in the directory at position p costs p + 1 directory probes, and 2p + 1
+failed open() calls (name-uninstalled.pc, then name.pc). Probes are counted
+this way from the solution, and checked against the 'trying path' messages
+of the libpkgconf trace for a small query. With the index, the packages are
+opened directly, after one listing of each directory.
+"""
+
+from pypkgconf import PkgconfClient
+
+from synthetic import generate, write_report
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+TRACE_LINES = 100000
+
+
+def spread(path: str, dirs: int, seed: int = 0):
+    """Move the .pc files of `path` to `dirs` subdirectories, and return them in search order"""
+    rng = random.Random(seed)
+    subdirs = [os.path.join(path, f'dir{i}') for i in range(dirs)]
+    for d in subdirs:
+        os.mkdir(d)
+    for entry in os.listdir(path):
+        if entry.endswith('.pc'):
+            os.rename(os.path.join(path, entry), os.path.join(rng.choice(subdirs), entry))
+    return subdirs
+
+
+def probes(dirs, name: str) -> int:
+    """Directories probed by libpkgconf to load the packages of a solution"""
+    client = PkgconfClient(with_paths=dirs)
+    # the directories of the personality come first
+    position = {d: i for i, d in enumerate(client._dir_key)}
+    views = client.solution(name)
+    return sum(position[os.path.dirname(v.filename)] + 1 for v in views)
+
+
+def traced_probes(dirs, name: str, index: bool) -> int:
+    client = PkgconfClient(with_paths=dirs, index=index, trace=TRACE_LINES)
+    client.libs(name)
+    lines = client.trace()
+    if len(lines) == TRACE_LINES:
+        raise RuntimeError('trace buffer too small')
+    return sum('trying path' in line for line in lines)
+
+
+def bench(dirs, targets, index: bool):
+    latencies = []
+    for name in targets:
+        client = PkgconfClient(with_paths=dirs, index=index)
+        start = time.perf_counter()
+        client.libs(name)
+        latencies.append(time.perf_counter() - start)
+    return {
+        'index': index,
+        'cold_median_s': statistics.median(latencies),
+        'cold_total_s': sum(latencies),
+        'probes_per_query': 0 if index else statistics.mean(probes(dirs, name) for name in targets),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--packages', type=int, default=2000)
+    parser.add_argument('--dirs', type=int, default=120, help='directories of the search path')
+    parser.add_argument('--targets', type=int, default=20)
+    parser.add_argument('--output', help='JSON output file, instead of stdout')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        names = generate(tmpdir, args.packages, 3)
+        dirs = spread(tmpdir, args.dirs)
+        targets = names[-args.targets:]
+        small = names[10]
+        assert traced_probes(dirs, small, False) == probes(dirs, small)
+        assert traced_probes(dirs, small, True) == 0
+
+        start = time.perf_counter()
+        PkgconfClient(with_paths=dirs, index=True).modversion(names[0])
+        index_s = time.perf_counter() - start
+        report = {
+            'packages': args.packages,
+            'dirs': args.dirs,
+            'index_build_s': index_s,
+            'results': [bench(dirs, targets, False), bench(dirs, targets, True)],
+        }
+
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+""" Latency and throughput of PkgconfClient queries on a synthetic package universe
+
+Results are written as JSON, to compare runs.
+"""
+
+from pypkgconf import PkgconfClient
+
+from synthetic import generate_universe, write_report
+
+import argparse
+import gc
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+OPERATIONS = {
+    'modversion': lambda client, name: client.modversion(name),
+    'cflags': lambda client, name: client.cflags(name),
+    'libs': lambda client, name: client.libs(name),
+    'libs_static': lambda client, name: client.libs(name),
+    'variable': lambda client, name: client.variable(name, 'libdir'),
+    'list_variables': lambda client, name: client.list_variables(name),
+}
+
+
+def _rss() -> int:
+    """Resident set size in bytes, or 0 if unknown"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _client(path: str, operation: str, cache: bool) -> PkgconfClient:
+    return PkgconfClient(with_paths=[path], cache=cache, static=operation == 'libs_static')
+
+
+def bench_operation(path: str, operation: str, targets, repeat: int):
+    func = OPERATIONS[operation]
+
+    # cold: first query of a new client, nothing parsed yet
+    cold = []
+    for name in targets:
+        client = _client(path, operation, cache=True)
+        start = time.perf_counter()
+        func(client, name)
+        cold.append(time.perf_counter() - start)
+
+    # warm: same queries again, with the parsed packages in the cache
+    warm = []
+    for name in targets:
+        func(client, name)
+    for _ in range(repeat):
+        for name in targets:
+            start = time.perf_counter()
+            func(client, name)
+            warm.append(time.perf_counter() - start)
+
+    # throughput without the cache, like the default client
+    client = _client(path, operation, cache=False)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for name in targets:
+            func(client, name)
+    uncached = time.perf_counter() - start
+
+    return {
+        'cold_median_s': statistics.median(cold),
+        'warm_median_s': statistics.median(warm),
+        'warm_throughput_qps': len(warm) / sum(warm),
+        'uncached_throughput_qps': repeat * len(targets) / uncached,
+    }
+
+
+def bench_construction(path: str, count: int):
+    gc.collect()
+    rss_before = _rss()
+    tracemalloc.start()
+    start = time.perf_counter()
+    clients = [PkgconfClient(with_paths=[path]) for _ in range(count)]
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = _rss()
+    del clients
+
+    return {
+        'count': count,
+        'mean_s': elapsed / count,
+        'python_bytes_per_client': peak / count,
+        'rss_bytes_per_client': (rss_after - rss_before) / count if rss_before else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--packages', type=int, default=2000, help='size of the random DAG')
+    parser.add_argument('--fanout', type=int, default=3)
+    parser.add_argument('--depth', type=int, default=100, help='length of the chain')
+    parser.add_argument('--width', type=int, default=50, help='width of diamonds and wide fan-out')
+    parser.add_argument('--repeat', type=int, default=5, help='warm passes over the targets')
+    parser.add_argument('--targets', type=int, default=20, help='random DAG packages to query')
+    parser.add_argument('--clients', type=int, default=100, help='clients created for the construction benchmark')
+    parser.add_argument('--operations', nargs='+', choices=sorted(OPERATIONS), default=list(OPERATIONS))
+    parser.add_argument('--output', help='JSON output file, instead of stdout')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        start = time.perf_counter()
+        shapes = generate_universe(tmpdir, count=args.packages, fanout=args.fanout, depth=args.depth,
+                                   width=args.width)
+        generate_time = time.perf_counter() - start
+        shapes['random'] = shapes['random'][-args.targets:]
+
+        results = []
+        for operation in args.operations:
+            for shape, targets in shapes.items():
+                result = bench_operation(tmpdir, operation, targets, args.repeat)
+                results.append({'operation': operation, 'shape': shape, 'targets': len(targets), **result})
+
+        report = {
+            'meta': {
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'pkgconf': PkgconfClient().version(),
+                'parameters': vars(args),
+                'files': len(os.listdir(tmpdir)),
+                'generate_s': generate_time,
+            },
+            'construction': bench_construction(tmpdir, args.clients),
+            'queries': results,
+        }
+
+    write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
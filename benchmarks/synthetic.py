@@ -0,0 +1,93 @@
+""" Generator of synthetic .pc file trees, and JSON reports, for the benchmarks """
+
+import json
+import os
+import random
+import sys
+import typing as T
+
+
+PC_TEMPLATE = """prefix=/opt/{name}
+libdir=${{prefix}}/lib
+includedir=${{prefix}}/include
+{variables}
+Name: {name}
+Description: Synthetic package {name}
+Version: {version}
+Requires: {requires}
+Requires.private: {requires_private}
+Libs: -L${{libdir}} -l{name}{libs}
+Libs.private: -lm -lpthread
+Cflags: -I${{includedir}} -D{define}
+"""
+
+
+def write_package(path: str, name: str, requires: T.Sequence[str] = (), requires_private: T.Sequence[str] = (),
+                  variables: int = 0, libs: int = 0, version: str = '1.0.0') -> None:
+    extra_vars = ''.join(f'var{i}=${{prefix}}/share/{name}/{i}\n' for i in range(variables))
+    extra_libs = ''.join(f' -l{name}_extra{i}' for i in range(libs))
+    with open(os.path.join(path, f'{name}.pc'), 'w') as f:
+        f.write(PC_TEMPLATE.format(name=name, variables=extra_vars, version=version,
+                                   requires=' '.join(requires), requires_private=' '.join(requires_private),
+                                   libs=extra_libs, define=name.upper()))
+
+
+def generate(path: str, count: int, fanout: int, seed: int = 0) -> T.List[str]:
+    """Random DAG of `count` packages, each requiring up to `fanout` earlier ones."""
+    rng = random.Random(seed)
+    names = [f'pkg{i}' for i in range(count)]
+    for i, name in enumerate(names):
+        write_package(path, name, rng.sample(names[:i], min(i, fanout)))
+    return names
+
+
+def generate_universe(path: str, count: int = 2000, fanout: int = 3, depth: int = 100,
+                      diamonds: int = 20, width: int = 50, variables: int = 30, libs: int = 40,
+                      seed: int = 0) -> T.Dict[str, T.List[str]]:
+    """Package universe mixing several shapes of dependency graphs.
+
+    Returns the names of the packages to query for each shape:
+    - random: `count` packages of a random DAG, see generate()
+    - chain: head of a chain of `depth` packages
+    - diamond: tops of `diamonds` diamonds, of `width` packages between top and bottom
+    - wide: a package requiring `width` leaves, plus one private leaf
+    - fat: packages with `variables` extra variables and `libs` extra libraries
+    """
+    shapes = {'random': generate(path, count, fanout, seed)}
+
+    for i in range(depth):
+        write_package(path, f'chain{i}', [f'chain{i - 1}'] if i else ())
+    shapes['chain'] = [f'chain{depth - 1}']
+
+    shapes['diamond'] = []
+    for d in range(diamonds):
+        write_package(path, f'diamond{d}_bottom')
+        middle = [f'diamond{d}_m{k}' for k in range(width)]
+        for name in middle:
+            write_package(path, name, [f'diamond{d}_bottom'])
+        write_package(path, f'diamond{d}_top', middle)
+        shapes['diamond'].append(f'diamond{d}_top')
+
+    leaves = [f'leaf{k}' for k in range(width)]
+    for name in leaves:
+        write_package(path, name)
+    write_package(path, 'leaf_private')
+    write_package(path, 'wide', leaves, ['leaf_private'])
+    shapes['wide'] = ['wide']
+
+    shapes['fat'] = []
+    for i in range(10):
+        write_package(path, f'fat{i}', [f'fat{i - 1}'] if i else (), variables=variables, libs=libs)
+        shapes['fat'].append(f'fat{i}')
+
+    return shapes
+
+
+def write_report(report: T.Mapping[str, T.Any], output: T.Optional[str] = None) -> None:
+    """Write a benchmark report as JSON to the `output` file, or else to stdout"""
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
@@ -1,3 +1,22 @@
-from .libpkgconf import PkgconfClient
+from .libpkgconf import ClientFork, ConstraintResults, Diagnostic, FragmentFilter, PkgconfClient, QueryError, QueryResult
+from .aio import AsyncPkgconfClient
+from .cross import CrossResolver, Target
+from .parallel import ParallelPkgconfResolver
+from .pool import PkgconfClientPool
+from .view import PackageView
 
-__all__ = ["PkgconfClient"]
+__all__ = [
+    "AsyncPkgconfClient",
+    "ClientFork",
+    "ConstraintResults",
+    "CrossResolver",
+    "Diagnostic",
+    "FragmentFilter",
+    "PackageView",
+    "PkgconfClient",
+    "PkgconfClientPool",
+    "ParallelPkgconfResolver",
+    "QueryError",
+    "QueryResult",
+    "Target",
+]
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+from .libpkgconf import PkgconfClient, QueryError, QueryResult
+from .pool import PkgconfClientPool
+
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import typing as T
+
+
+class AsyncPkgconfClient:
+    """asyncio front-end for PkgconfClient.
+
+    Queries run on a thread pool of `max_workers` threads, each with its
+    own client, so they never block the event loop. At most
+    `max_concurrency` queries are submitted at once. Cancelling a query
+    that did not start yet removes it from the executor; a query already
+    running in libpkgconf completes, but its result is dropped.
+    """
+
+    def __init__(self, client: T.Optional[PkgconfClient] = None, max_workers: T.Optional[int] = None,
+                 max_concurrency: T.Optional[int] = None, **kwargs):
+        self._pool = PkgconfClientPool(client, **kwargs)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pypkgconf')
+        self._semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+
+    async def __aenter__(self) -> AsyncPkgconfClient:
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _call(self, name: str, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        func = functools.partial(self._pool._call, name, *args, **kwargs)
+        if self._semaphore is None:
+            return await loop.run_in_executor(self._executor, func)
+        async with self._semaphore:
+            return await loop.run_in_executor(self._executor, func)
+
+    async def modversion(self, package: str) -> T.Optional[str]:
+        return await self._call('modversion', package)
+
+    async def cflags(self, packages: T.Union[str, T.List[str]], **kwargs) -> T.Optional[str]:
+        return await self._call('cflags', packages, **kwargs)
+
+    async def libs(self, packages: T.Union[str, T.List[str]], **kwargs) -> T.Optional[str]:
+        return await self._call('libs', packages, **kwargs)
+
+    async def cflags_fragments(self, packages: T.Union[str, T.List[str]], **kwargs):
+        return await self._call('cflags_fragments', packages, **kwargs)
+
+    async def libs_fragments(self, packages: T.Union[str, T.List[str]], **kwargs):
+        return await self._call('libs_fragments', packages, **kwargs)
+
+    async def variable(self, package: str, variable_name: str) -> T.Optional[str]:
+        return await self._call('variable', package, variable_name)
+
+    async def list_variables(self, package: str) -> T.Optional[T.List[str]]:
+        return await self._call('list_variables', package)
+
+    async def query(self, packages: T.Union[str, T.List[str]], **kwargs) -> T.Optional[QueryResult]:
+        return await self._call('query', packages, **kwargs)
+
+    async def batch_query(self, package_lists: T.Iterable[T.Union[str, T.List[str]]], chunksize: int = 16,
+                          **kwargs) -> T.List[T.Union[QueryResult, QueryError]]:
+        """Like PkgconfClient.batch_query, with chunks spread over the workers.
+
+        Cancelling the batch cancels all its pending chunks.
+        """
+        package_lists = list(package_lists)
+        chunks = [package_lists[i:i + chunksize] for i in range(0, len(package_lists), chunksize)]
+        results = await asyncio.gather(*(self._call('batch_query', chunk, **kwargs) for chunk in chunks))
+        return [r for chunk_results in results for r in chunk_results]
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+from . import flags
+from .libpkgconf import PkgconfClient, QueryError, QueryResult
+
+from dataclasses import dataclass, replace
+import os
+import typing as T
+
+
+Result = T.Union[QueryResult, QueryError]
+
+
+@dataclass(frozen=True)
+class Target:
+    """A cross-compilation target.
+
+    `personality` is the triplet used to find the cross personality, None for
+    the default one. `sysroot` overrides the sysroot of the personality, and
+    `with_paths` are searched after its directories.
+    """
+    name: str
+    personality: T.Optional[str] = None
+    sysroot: T.Optional[str] = None
+    with_paths: T.Tuple[str, ...] = ()
+
+
+@dataclass
+class CrossStats:
+    solves: int = 0
+    shared: int = 0
+
+
+def _find_file(dirs: T.Tuple[str, ...], name: str, uninstalled: bool) -> T.Optional[str]:
+    """The .pc file pkgconf_pkg_find() would load for `name`, without parsing it"""
+    if os.sep in name or name.endswith('.pc'):
+        return None
+    for d in dirs:
+        if uninstalled:
+            path = f'{d}/{name}-uninstalled.pc'
+            if os.path.isfile(path):
+                return path
+        path = f'{d}/{name}.pc'
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+class CrossResolver:
+    """Resolve the same queries for several cross-compilation targets.
+
+    Each target has its own cached PkgconfClient. A result is reused for
+    another target when both parse .pc files the same way (flags, variables,
+    sysroot), filter the same system directories, and every package lookup
+    of the solution finds the same file in the search path of the other
+    target. Only the existence of the files is checked then, nothing is
+    parsed or solved again.
+    """
+
+    def __init__(self, targets: T.Iterable[T.Union[str, Target]], **kwargs):
+        self.targets = tuple(t if isinstance(t, Target) else Target(t, personality=t) for t in targets)
+        names = [t.name for t in self.targets]
+        if len(set(names)) != len(names):
+            raise ValueError('target names must be unique')
+
+        kwargs.setdefault('cache', True)
+        self._clients: T.Dict[str, PkgconfClient] = {}
+        for target in self.targets:
+            client = PkgconfClient(with_paths=list(target.with_paths) or None, personality=target.personality,
+                                   **kwargs)
+            if target.sysroot:
+                client.set_sysroot(target.sysroot)
+            self._clients[target.name] = client
+        self._stats = CrossStats()
+
+    def client(self, target: str) -> PkgconfClient:
+        return self._clients[target]
+
+    def stats(self) -> CrossStats:
+        return replace(self._stats)
+
+    def __share_key(self, client: PkgconfClient) -> T.Tuple:
+        return (client._parse_key(), client._options.flags, client._filter_dirs(), client._registry_digest)
+
+    def query(self, packages: T.Union[str, T.List[str]], **query_kwargs) -> T.Dict[str, Result]:
+        """Result of PkgconfClient.query() for each target, by target name.
+
+        Failures are reported as QueryError instances.
+        """
+        return {name: results[0] for name, results in self.batch_query([packages], **query_kwargs).items()}
+
+    def batch_query(self, package_lists: T.Iterable[T.Union[str, T.List[str]]],
+                    **query_kwargs) -> T.Dict[str, T.List[Result]]:
+        """Like PkgconfClient.batch_query, for each target.
+
+        `query_kwargs` are passed to PkgconfClient.batch_query.
+        """
+        package_lists = [[p] if isinstance(p, str) else list(p) for p in package_lists]
+        results = {t.name: [] for t in self.targets}
+        keys = {name: self.__share_key(client) for name, client in self._clients.items()}
+        # the first item of the parse key is the client flags
+        uninstalled = {name: not key[0][0] & flags.PKGF_NO_UNINSTALLED for name, key in keys.items()}
+        # Lookups are probed once per target and batch
+        found: T.Dict[str, T.Dict[str, T.Optional[str]]] = {name: {} for name in self._clients}
+
+        def find(target: str, name: str) -> T.Optional[str]:
+            if name not in found[target]:
+                found[target][name] = _find_file(self._clients[target]._dir_key, name, uninstalled[target])
+            return found[target][name]
+
+        for packages in package_lists:
+            # (share key, lookups, result) of the targets solved for these packages
+            donors = []
+            for target in self.targets:
+                client = self._clients[target.name]
+                for key, lookups, result in donors:
+                    if key == keys[target.name] and all(find(target.name, n) == f for n, f in lookups.items()):
+                        results[target.name].append(replace(result, variables=dict(result.variables)))
+                        self._stats.shared += 1
+                        break
+                else:
+                    client._lookups = {}
+                    try:
+                        result = client.batch_query([packages], **query_kwargs)[0]
+                        lookups = client._lookups
+                    finally:
+                        client._lookups = None
+                    self._stats.solves += 1
+                    results[target.name].append(result)
+
+                    if isinstance(result, QueryResult):
+                        for name in client._requested_names(packages):
+                            lookups[name] = find(target.name, name)
+                        if all(lookups.values()):
+                            donors.append((keys[target.name], lookups, result))
+
+        return results
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import hashlib
+import marshal
+import os
+import shutil
+import threading
+import typing as T
+
+
+StatKey = T.Optional[T.Tuple[int, int, int]]
+
+
+def stat_key(path: T.Union[str, bytes]) -> StatKey:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+class DiskCache:
+    """Directory of query results, shared by processes and runs.
+
+    Each entry records the stat of the files it was computed from, and is
+    only returned while they are unchanged. Entries are written to a
+    temporary file then renamed, so readers never see a partial entry and
+    do not need any lock.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __entry(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.path, digest[:2], digest[2:])
+
+    def get(self, key: str, default: T.Any = None) -> T.Any:
+        try:
+            with open(self.__entry(key), 'rb') as f:
+                stored_key, deps, value = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return default
+
+        if stored_key != key:
+            return default
+        for path, stat in deps:
+            if stat_key(path) != stat:
+                return default
+        return value
+
+    def put(self, key: str, deps: T.Iterable[T.Tuple[str, StatKey]], value: T.Any) -> None:
+        entry = self.__entry(key)
+        tmp = f'{entry}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            with open(tmp, 'wb') as f:
+                marshal.dump((key, tuple(deps), value), f)
+            os.replace(tmp, entry)
+        except OSError:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
+    def clear(self) -> None:
+        shutil.rmtree(self.path, ignore_errors=True)
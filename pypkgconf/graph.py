@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+from . import flags
+
+from array import array
+from dataclasses import dataclass
+import typing as T
+
+
+COMPARATORS = ('!=', '', '<', '<=', '=', '>', '>=')
+
+
+@dataclass(frozen=True, eq=False)
+class DependencyGraph:
+    """Immutable dependency graph of a solved query.
+
+    Nodes are packages, identified by integer ids indexing `names`,
+    `versions` and `provides`. Edges are stored in parallel arrays:
+    edge i goes from `edge_source[i]` to `edge_target[i]` (the package
+    required), with the libpkgconf comparator `edge_compare[i]`, the
+    version constraint `edge_version[i]` and the DEPF_* `edge_flags[i]`.
+
+    Graphs are shared by the callers of a memoized query, so the arrays
+    are exposed as read-only memoryviews, and graphs compare by identity.
+    """
+
+    names: T.Tuple[str, ...]
+    versions: T.Tuple[T.Optional[str], ...]
+    provides: T.Tuple[T.Tuple[str, ...], ...]
+    roots: T.Sequence[int]
+    edge_source: T.Sequence[int]
+    edge_target: T.Sequence[int]
+    edge_compare: T.Sequence[int]
+    edge_flags: T.Sequence[int]
+    edge_version: T.Tuple[T.Optional[str], ...]
+
+    def __post_init__(self):
+        for name in _ARRAY_FIELDS:
+            object.__setattr__(self, name, memoryview(getattr(self, name)).toreadonly())
+        object.__setattr__(self, '_ids', {name: i for i, name in enumerate(self.names)})
+
+    def __reduce__(self):
+        arrays = {name: array(getattr(self, name).format, getattr(self, name)) for name in _ARRAY_FIELDS}
+        return (_rebuild_graph, (self.names, self.versions, self.provides, self.edge_version, arrays))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def node(self, name: str) -> int:
+        return self._ids[name]
+
+    def constraint(self, edge: int) -> str:
+        version = self.edge_version[edge]
+        if not version:
+            return self.names[self.edge_target[edge]]
+        return f'{self.names[self.edge_target[edge]]} {COMPARATORS[self.edge_compare[edge]]} {version}'
+
+    def is_private(self, edge: int) -> bool:
+        return bool(self.edge_flags[edge] & flags.DEPF_PRIVATE)
+
+    def is_internal(self, edge: int) -> bool:
+        return bool(self.edge_flags[edge] & flags.DEPF_INTERNAL)
+
+    def _adjacency(self, reverse: bool) -> T.Tuple[T.List[int], ...]:
+        attr = '_reverse' if reverse else '_forward'
+        adjacency = self.__dict__.get(attr)
+        if adjacency is None:
+            adjacency = tuple([] for _ in self.names)
+            src, dst = (self.edge_target, self.edge_source) if reverse else (self.edge_source, self.edge_target)
+            for s, d in zip(src, dst):
+                adjacency[s].append(d)
+            object.__setattr__(self, attr, adjacency)
+        return adjacency
+
+    def dependencies(self, node: int) -> T.List[int]:
+        return list(self._adjacency(False)[node])
+
+    def reverse_dependencies(self, node: int) -> T.List[int]:
+        return list(self._adjacency(True)[node])
+
+    def transitive_dependencies(self, node: int) -> T.Set[int]:
+        forward = self._adjacency(False)
+        seen = set()
+        stack = [node]
+        while stack:
+            for d in forward[stack.pop()]:
+                if d not in seen:
+                    seen.add(d)
+                    stack.append(d)
+        seen.discard(node)
+        return seen
+
+    def topological_order(self) -> T.List[int]:
+        """Node ids, each one after all its dependencies.
+
+        Nodes that are part of a dependency cycle come last, by id.
+        """
+        order = self.__dict__.get('_order')
+        if order is None:
+            forward = self._adjacency(False)
+            reverse = self._adjacency(True)
+            pending = [len(set(d)) for d in forward]
+            ready = [n for n, count in enumerate(pending) if count == 0]
+            order = []
+            while ready:
+                node = ready.pop()
+                order.append(node)
+                for parent in set(reverse[node]):
+                    pending[parent] -= 1
+                    if pending[parent] == 0:
+                        ready.append(parent)
+            if len(order) != len(self.names):
+                placed = set(order)
+                order.extend(n for n in range(len(self.names)) if n not in placed)
+            object.__setattr__(self, '_order', order)
+        return list(order)
+
+
+_ARRAY_FIELDS = ('roots', 'edge_source', 'edge_target', 'edge_compare', 'edge_flags')
+
+
+def _rebuild_graph(names, versions, provides, edge_version, arrays) -> DependencyGraph:
+    return DependencyGraph(names=names, versions=versions, provides=provides, edge_version=edge_version, **arrays)
@@ -1,31 +1,67 @@
 from __future__ import annotations
 
-from . import flags
+from . import _libpkgconf, flags
 from ._libpkgconf import ffi, lib
+from .diskcache import DiskCache, StatKey, stat_key
+from .graph import COMPARATORS, DependencyGraph
+from .view import PackageView
 
-from dataclasses import dataclass, field, fields
+from array import array
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field, fields, replace
 from contextlib import contextmanager
+import copy
+from functools import lru_cache
+import hashlib
+import json
 import logging
 import os
 import sys
+import threading
+import time
 import typing as T
+import weakref
 
 
 logger = logging.getLogger(__name__)
 
-@ffi.def_extern()
-def error_handler(msg: str, client, data) -> bool:
-    """ This is a Python callback to handle errors """
-    log_level = ffi.from_handle(data)
 
-    logger.log(log_level, ffi.string(msg).decode(errors='replace').rstrip())
-    return True
+class _MessageRing:
+    """Bounded buffer filled by the native pypkgconf_ring_handler.
+
+    Messages are only decoded when read, and the oldest ones are
+    overwritten when it is full.
+    """
+
+    def __init__(self, capacity: int, line_size: int = 512):
+        self._lines = ffi.new('char[]', capacity * line_size) if capacity else ffi.NULL
+        self.ring = ffi.new('pypkgconf_ring_t *')
+        self.ring.lines = self._lines
+        self.ring.line_size = line_size
+        self.ring.capacity = capacity
+
+    def clear(self) -> None:
+        self.ring.count = 0
+
+    def __len__(self) -> int:
+        return min(self.ring.count, self.ring.capacity)
+
+    def lines(self) -> T.List[str]:
+        ring = self.ring
+        n = len(self)
+        start = ring.count - n
+        return [ffi.string(self._lines + ((start + i) % ring.capacity) * ring.line_size).decode(errors='replace').rstrip('\n')
+                for i in range(n)]
+
+
+_ring_handler = ffi.addressof(lib, 'pypkgconf_ring_handler')
 
 
 @dataclass(kw_only=True)
 class FilterData:
     keep_system: bool = False
     fragment_filter: T.Optional[str] = None
+    predicate: T.Optional[T.Callable[[str, str], bool]] = None
 
     def __post_init__(self):
         self._known_flags = {f.metadata.get('type'): f.name for f in fields(self) if 'type' in f.metadata}
@@ -44,6 +80,24 @@ class FilterData:
             return True
         
         return not self._has_filter
+
+    def type_mask(self) -> bytes:
+        """ Result of filter() for each possible fragment type """
+        default = not self._has_filter
+        other = default or bool(self._other_name and getattr(self, self._other_name))
+
+        mask = bytearray([other]) * 256
+        for type, name in self._known_flags.items():
+            mask[ord(type)] = default or bool(getattr(self, name))
+
+        if self.fragment_filter:
+            allowed = bytearray(256)
+            for t in self.fragment_filter.encode():
+                allowed[t] = mask[t]
+            mask = allowed
+
+        return bytes(mask)
+
         
 @dataclass(kw_only=True)
 class CflagFilterData(FilterData):
@@ -58,25 +112,170 @@ class LibsFilterData(FilterData):
     only_other: bool = field(default=False, metadata={'type': '*'})
 
 
-def _filter_func(client, frag, flags: FilterData):
-    if not flags.keep_system and lib.pkgconf_fragment_has_system_dir(client, frag):
+class FragmentFilter:
+    """Precompiled fragment filter, for cflags(), libs() and the query APIs.
+
+    Build it with FragmentFilter.cflags() or FragmentFilter.libs(), which
+    take the options of CflagFilterData or LibsFilterData. Instances are
+    interned by their options, and immutable.
+    """
+
+    __slots__ = ('kind', 'options', 'keep_system', 'type_mask', 'predicate', '_native', '_handle')
+
+    def __init__(self, kind: str, options: T.Tuple[T.Tuple[str, T.Any], ...]):
+        data = (CflagFilterData if kind == 'cflags' else LibsFilterData)(**dict(options))
+        self.kind = kind
+        self.options = options
+        self.keep_system = bool(data.keep_system)
+        self.type_mask = data.type_mask()
+        self.predicate = data.predicate
+
+        # data for the native pypkgconf_filter_fragment filter, and for the
+        # Python one when there is a predicate
+        self._native = ffi.new('pypkgconf_filter_t *')
+        self._native.keep_system = self.keep_system
+        ffi.memmove(self._native.types, self.type_mask, 256)
+        self._handle = ffi.new_handle(self) if self.predicate is not None else None
+
+    @classmethod
+    def cflags(cls, **options) -> FragmentFilter:
+        options.setdefault('keep_system', bool(os.environ.get('PKG_CONFIG_ALLOW_SYSTEM_CFLAGS', False)))
+        return _intern_filter('cflags', tuple(sorted(options.items())))
+
+    @classmethod
+    def libs(cls, **options) -> FragmentFilter:
+        options.setdefault('keep_system', bool(os.environ.get('PKG_CONFIG_ALLOW_SYSTEM_LIBS', False)))
+        return _intern_filter('libs', tuple(sorted(options.items())))
+
+    def __setattr__(self, name, value):
+        if hasattr(self, '_handle'):
+            raise AttributeError(f'{type(self).__name__} is immutable')
+        super().__setattr__(name, value)
+
+    def __eq__(self, other):
+        if not isinstance(other, FragmentFilter):
+            return NotImplemented
+        return (self.kind, self.options) == (other.kind, other.options)
+
+    def __hash__(self):
+        return hash((self.kind, self.options))
+
+    def __reduce__(self):
+        return (_intern_filter, (self.kind, self.options))
+
+    def __repr__(self):
+        options = ', '.join(f'{k}={v!r}' for k, v in self.options)
+        return f'FragmentFilter.{self.kind}({options})'
+
+
+@lru_cache(maxsize=256)
+def _intern_filter(kind: str, options: T.Tuple[T.Tuple[str, T.Any], ...]) -> FragmentFilter:
+    return FragmentFilter(kind, options)
+
+
+class _PredicateCalls:
+    """A FragmentFilter counting the calls of its predicate, when profiling"""
+
+    __slots__ = ('filter', 'calls')
+
+    def __init__(self, flt: FragmentFilter):
+        self.filter = flt
+        self.calls = 0
+
+
+def _filter_func(client, frag, flt: T.Union[FragmentFilter, _PredicateCalls]):
+    counter = None
+    if isinstance(flt, _PredicateCalls):
+        counter, flt = flt, flt.filter
+
+    if not flt.type_mask[ord(frag.type)]:
         return False
-    
-    return flags.filter(frag.type.decode())
+
+    if not flt.keep_system and lib.pkgconf_fragment_has_system_dir(client, frag):
+        return False
+
+    if counter is not None:
+        counter.calls += 1
+    return bool(flt.predicate(frag.type.decode(), ffi.string(frag.data).decode()))
 
 
 @ffi.def_extern()
 def filter_cflags(client, frag, data) -> bool:
-    flags: CflagFilterData = ffi.from_handle(data)
+    flt: FragmentFilter = ffi.from_handle(data)
 
-    return _filter_func(client, frag, flags)
+    return _filter_func(client, frag, flt)
 
 
 @ffi.def_extern()
 def filter_libs(client, frag, data) -> bool:
-    flags: LibsFilterData = ffi.from_handle(data)
+    flt: FragmentFilter = ffi.from_handle(data)
+
+    return _filter_func(client, frag, flt)
+
+
+def _fragment_filter(client, dest, src, flt: FragmentFilter, python_filter,
+                     counter: T.Optional[_PredicateCalls] = None) -> None:
+    # The Python callback is only needed for user-supplied predicates,
+    # the builtin options are handled by the native filter.
+    if flt.predicate is None:
+        lib.pkgconf_fragment_filter(client, dest, src, _native_filter_func, flt._native)
+    elif counter is not None:
+        lib.pkgconf_fragment_filter(client, dest, src, python_filter, ffi.new_handle(counter))
+    else:
+        lib.pkgconf_fragment_filter(client, dest, src, python_filter, flt._handle)
+
+
+_native_filter_func = ffi.addressof(lib, 'pypkgconf_filter_fragment')
+
+
+def _check_filter(kind: str, flt: T.Union[FragmentFilter, T.Dict[str, T.Any], None],
+                  options: T.Optional[T.Dict[str, T.Any]] = None) -> FragmentFilter:
+    if isinstance(flt, FragmentFilter):
+        if options:
+            raise ValueError('filter options cannot be combined with a FragmentFilter')
+        if flt.kind != kind:
+            raise ValueError(f'{flt!r} cannot filter {kind}')
+        return flt
+    return getattr(FragmentFilter, kind)(**(flt or options or {}))
+
+
+# Part of the disk cache keys: results may change with the libpkgconf build
+_EXTENSION_KEY = (sys.version_info[:2], stat_key(_libpkgconf.__file__))
+
+_WORLD_ID = ffi.new('char[]', b'virtual:world')
+_WORLD_REALNAME = ffi.new('char[]', b'virtual world package')
+_EMPTY_VERSION = ffi.new('char[]', b'')
+
+
+def _optional_string(s) -> T.Optional[str]:
+    return ffi.string(s).decode(errors='replace') if s != ffi.NULL else None
 
-    return _filter_func(client, frag, flags)
+
+@dataclass(frozen=True)
+class PackageInfo:
+    id: str
+    version: T.Optional[str]
+    description: T.Optional[str]
+    filename: T.Optional[str]
+
+
+@ffi.def_extern()
+def collect_package_info(pkg, data) -> bool:
+    packages: T.Dict[str, PackageInfo] = ffi.from_handle(data)
+
+    id = ffi.string(pkg.id).decode()
+    if id not in packages:
+        packages[id] = PackageInfo(id, _optional_string(pkg.version), _optional_string(pkg.description),
+                                   _optional_string(pkg.filename))
+    return False
+
+
+@ffi.def_extern()
+def collect_graph_node(client, pkg, data) -> None:
+    nodes: T.List = ffi.from_handle(data)
+
+    if not pkg.flags & flags.PROPF_VIRTUAL:
+        nodes.append(pkg)
 
 
 class NodeIter:
@@ -104,7 +303,7 @@ class PkgconfFlags:
     static: bool = False
 
     debug: bool = False
-    maximum_traverse_depth = 2000
+    maximum_traverse_depth: int = 2000
 
     def __post_init__(self):
         if os.environ.get('PKG_CONFIG_DONT_DEFINE_PREFIX'):
@@ -139,134 +338,954 @@ class PkgconfFlags:
         return changed
 
 
-class PkgconfClient:
+Fragments = T.Union[T.Tuple[T.Tuple[str, str], ...], T.Tuple[str, ...]]
 
-    def __init__(self, define_variables: T.Optional[T.Dict[str, str]] = None,
-                 with_paths: T.Optional[T.List[str]] = None, **kwargs):
-        self._personality = lib.pkgconf_cross_personality_default()
-        if with_paths:
-            self.__add_paths(with_paths)
+QUERY_FIELDS = frozenset(('modversion', 'cflags', 'libs', 'libs_static'))
 
-        self._options = PkgconfFlags(**kwargs)
-        self.__init_client(self._options.debug)
 
-        self._variables = {}
-        if define_variables:
-            self.define_variables(**define_variables)
+@dataclass
+class QueryResult:
+    modversion: T.Optional[str] = None
+    cflags: T.Optional[str] = None
+    libs: T.Optional[str] = None
+    libs_static: T.Optional[str] = None
+    variables: T.Dict[str, T.Optional[str]] = field(default_factory=dict)
 
-        lib.pkgconf_client_set_flags(self._client, self._options.flags)
 
-        # at this point, want_client_flags should be set, so build the dir list
-        lib.pkgconf_client_dir_list_build(self._client, self._personality)
+def _registry_hash(name: str, entry: T.Tuple[bytes, str, int]) -> int:
+    return int.from_bytes(hashlib.sha256(repr((name, entry)).encode()).digest(), 'big')
+
+
+def pc_source(name: str, definition: T.Mapping[str, T.Any]) -> bytes:
+    """Content of a .pc file defined by a mapping of its fields.
+
+    Values may be strings or lists, and the 'variables' item is a mapping of
+    the variables. Name and Description default to the package name.
+    """
+    lines = [f'{key}={value}' for key, value in definition.get('variables', {}).items()]
+    lines.append('')
+    fields = {'Name': name, 'Description': name}
+    fields.update((k, v) for k, v in definition.items() if k != 'variables')
+    for key, value in fields.items():
+        if not isinstance(value, str):
+            separator = ', ' if key.split('.')[0].lower() in ('requires', 'conflicts', 'provides') else ' '
+            value = separator.join(value)
+        lines.append(f'{key}: {value}')
+    return '\n'.join(lines).encode() + b'\n'
+
+
+# 'foo >= 1.0', ('foo', '>=', '1.0') or ('foo',)
+Constraint = T.Union[str, T.Tuple[str, ...]]
+
+
+@dataclass(frozen=True)
+class ConstraintResults:
+    """Results of PkgconfClient.check_constraints(), in the order of the constraints.
+
+    `results[i]` is 1 if constraint i is satisfied, 0 if the version does not
+    match, and -1 if the package is not found. `versions` maps each package
+    to the version found, or None.
+    """
+    constraints: T.Tuple[Constraint, ...]
+    results: array
+    versions: T.Dict[str, T.Optional[str]]
+
+    def __len__(self) -> int:
+        return len(self.results)
 
-    def __init_client(self, debug: bool):
-        self.__debug_level = ffi.new_handle(logging.DEBUG)
-        self.__error_level = ffi.new_handle(logging.ERROR)
+    def __getitem__(self, index: int) -> bool:
+        return self.results[index] > 0
 
-        self._client = lib.pkgconf_client_new(lib.error_handler, self.__error_level, self._personality)
-        if debug:
-            lib.pkgconf_client_set_trace_handler(self._client, lib.error_handler, self.__debug_level)
+    def satisfied(self) -> bool:
+        return all(r > 0 for r in self.results)
+
+    def failed(self) -> T.List[Constraint]:
+        return [c for c, r in zip(self.constraints, self.results) if r <= 0]
+
+
+@dataclass(frozen=True)
+class Diagnostic:
+    """Why a dependency could not be solved. `code` is an ERRF_* flag."""
+    code: int
+    package: T.Optional[str] = None
+    constraint: T.Optional[str] = None
+    required_by: T.Optional[str] = None
+    version: T.Optional[str] = None
+
+    def __str__(self) -> str:
+        required_by = f", required by '{self.required_by}'" if self.required_by else ''
+        if self.code & flags.ERRF_PACKAGE_NOT_FOUN:
+            return f"Package '{self.package}'{required_by} not found"
+        if self.code & flags.ERRF_PACKAGE_VER_MISMATC:
+            return f"Package '{self.package}' has version '{self.version}', requirement '{self.constraint}'{required_by} not satisfied"
+        if self.code & flags.ERRF_PACKAGE_CONFLIC:
+            return f"Version '{self.version}' of '{self.package}' conflicts with '{self.required_by}' due to rule '{self.constraint}'"
+        return 'Dependency graph could not be built'
+
+
+class QueryError(Exception):
+
+    def __init__(self, packages: T.List[str], message: str, diagnostics: T.Sequence[Diagnostic] = ()):
+        super().__init__(message)
+        self.packages = packages
+        self.message = message
+        self.diagnostics = tuple(diagnostics)
+
+    def __reduce__(self):
+        return (QueryError, (self.packages, self.message, self.diagnostics))
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    size: int = 0
+
+
+@dataclass(frozen=True)
+class QueryProfile:
+    packages: T.Tuple[str, ...]
+    files: T.Tuple[str, ...]
+    audit: T.Tuple[str, ...]
+
+
+@dataclass
+class ProfileStats:
+    """Timers (in seconds) and counters collected while profiling is enabled.
+
+    `recent` holds a QueryProfile for the latest solves: the requested
+    packages, the .pc files loaded to solve them, and the lines libpkgconf
+    wrote to its audit log.
+    """
+    solve_time: float = 0.0
+    collect_time: float = 0.0
+    filter_time: float = 0.0
+    render_time: float = 0.0
+    queries: int = 0
+    packages_loaded: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    fragments_collected: int = 0
+    fragments_filtered: int = 0
+    callbacks: int = 0
+    recent: T.Sequence[QueryProfile] = ()
+
+
+@dataclass
+class MemoStats:
+    hits: int = 0
+    misses: int = 0
+    size: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+_MISSING = object()
+
+
+class _ResultMemo:
+    """LRU of query results, with an optional time to live in seconds"""
+
+    def __init__(self, maxsize: int, ttl: T.Optional[float]):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: OrderedDict = OrderedDict()
+        self.stats = MemoStats()
+        # forks of a client share its memo, and may be used from other threads
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or time.monotonic() < expires:
+                    self.entries.move_to_end(key)
+                    self.stats.hits += 1
+                    return value
+                del self.entries[key]
+            self.stats.misses += 1
+            return _MISSING
+
+    def put(self, key, value) -> None:
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.entries.clear()
+
+
+class SearchPath:
+    """Cross personality with extra search paths, shared by clients.
+
+    The personality is the default one, or the one found for the `triplet`
+    of a cross-compilation target. It is immutable once built; use
+    SearchPath.get() to reuse the instance built for the same arguments.
+    """
+
+    # instances are freed with the last client using them
+    _instances: T.MutableMapping[T.Tuple[T.Tuple[str, ...], T.Optional[str]], SearchPath] = \
+        weakref.WeakValueDictionary()
+    # reentrant, since a collected instance releases its personality with it held
+    _lock = threading.RLock()
+
+    def __init__(self, paths: T.Iterable[str] = (), triplet: T.Optional[str] = None):
+        self.paths = tuple(paths)
+        self.triplet = triplet
+
+        # personality lookups are not thread safe. pkgconf_cross_personality_find()
+        # falls back to the default personality, which must be released; the
+        # ones loaded from files are freed with the instance.
+        with SearchPath._lock:
+            if triplet is None:
+                self._default = lib.pkgconf_cross_personality_default()
+                base = self._default
+            else:
+                base = lib.pkgconf_cross_personality_find(triplet.encode())
+                if base == ffi.NULL:
+                    raise ValueError(f'invalid personality {triplet!r}')
+                default = lib.pkgconf_cross_personality_default()
+                if base == default:
+                    self._default = base
+                else:
+                    self._loaded = base
+                lib.pkgconf_cross_personality_deinit(default)
+
+        self.sysroot = _optional_string(base.sysroot_dir)
+        self._personality = ffi.new('pkgconf_cross_personality_t *')
+        self._personality.want_default_static = base.want_default_static
+        self._personality.want_default_pure = base.want_default_pure
+        lib.pkgconf_path_copy_list(ffi.addressof(self._personality.dir_list), ffi.addressof(base.dir_list))
+        lib.pkgconf_path_copy_list(ffi.addressof(self._personality.filter_libdirs),
+                                   ffi.addressof(base.filter_libdirs))
+        lib.pkgconf_path_copy_list(ffi.addressof(self._personality.filter_includedirs),
+                                   ffi.addressof(base.filter_includedirs))
 
-    def __add_paths(self, paths: T.List[str]):
         dir_list = ffi.new('pkgconf_list_t *')
-        for p in paths:
+        for p in self.paths:
             lib.pkgconf_path_add(p.encode(), dir_list, True)
         lib.pkgconf_path_copy_list(ffi.addressof(self._personality.dir_list), dir_list)
         lib.pkgconf_path_free(dir_list)
 
-    def __getstate__(self) -> object:
-        d = self.__dict__.copy()
+    @classmethod
+    def get(cls, paths: T.Optional[T.Iterable[str]] = None, triplet: T.Optional[str] = None) -> SearchPath:
+        key = (tuple(paths or ()), triplet)
+        search_path = cls._instances.get(key)
+        if search_path is None:
+            with cls._lock:
+                search_path = cls._instances.get(key)
+            if search_path is None:
+                search_path = cls(*key)
+                with cls._lock:
+                    search_path = cls._instances.setdefault(key, search_path)
+        return search_path
+
+    def __reduce__(self):
+        return (SearchPath.get, (self.paths, self.triplet))
 
-        d['_paths'] = []
-        for p in NodeIter(self._personality.dir_list, 'pkgconf_path_t *'):
-            d['_paths'].append(ffi.string(p.path).decode())
-
-        sysroot = lib.pkgconf_client_get_sysroot_dir(self._client)
-        if sysroot != ffi.NULL:
-            d['_sysroot'] = ffi.string()
-        del d['_client']
-        del d['_personality']
-        del d['_PkgconfClient__error_level']
-        del d['_PkgconfClient__debug_level']
-        return d
+    def __del__(self):
+        if hasattr(self, '_personality'):
+            lib.pkgconf_path_free(ffi.addressof(self._personality.dir_list))
+            lib.pkgconf_path_free(ffi.addressof(self._personality.filter_libdirs))
+            lib.pkgconf_path_free(ffi.addressof(self._personality.filter_includedirs))
+        if hasattr(self, '_default'):
+            with SearchPath._lock:
+                lib.pkgconf_cross_personality_deinit(self._default)
+        if hasattr(self, '_loaded'):
+            lib.pypkgconf_personality_free(self._loaded)
+
+
+class _PackageIndex:
+    """Package name -> .pc file found first in a search path, like pkgconf_pkg_find().
+
+    It is built with one listing of each directory, and rebuilt when the
+    stat of a directory changes.
+    """
+
+    def __init__(self, dirs: T.Tuple[str, ...], uninstalled: bool):
+        self.dirs = dirs
+        self.uninstalled = uninstalled
+        self.build()
+
+    def build(self) -> None:
+        # replaced at once, since forks of a client share its index
+        stats = {d: stat_key(d) for d in self.dirs}
+        files: T.Dict[str, T.Tuple[str, bool]] = {}
+        for d in self.dirs:
+            try:
+                entries = os.listdir(d)
+            except OSError:
+                continue
+            found = {}
+            uninstalled = {}
+            for entry in entries:
+                if not entry.endswith('.pc'):
+                    continue
+                name = entry[:-3]
+                path = f'{d}/{entry}'
+                found[name] = (path, False)
+                if self.uninstalled and name.endswith('-uninstalled'):
+                    uninstalled[name[:-len('-uninstalled')]] = (path, True)
+            # in a directory, name-uninstalled.pc is tried before name.pc
+            found.update(uninstalled)
+            for name, entry in found.items():
+                files.setdefault(name, entry)
+        self.stats, self.files = stats, files
+
+    def changed(self) -> bool:
+        return any(stat_key(d) != stat for d, stat in self.stats.items())
+
+
+# Flags only used to solve and collect fragments: parsed packages are cached
+# across changes of these
+_SOLVE_FLAGS = (flags.PKGF_SEARCH_PRIVATE | flags.PKGF_MERGE_PRIVATE_FRAGMENT | flags.PKGF_SKIP_ROOT_VIRTUAL
+                | flags.PKGF_SKIP_CONFLICTS | flags.PKGF_SKIP_ERRORS | flags.PKGF_ITER_PKG_IS_PRIVATE
+                | flags.PKGF_SIMPLIFY_ERRORS | flags.PKGF_DONT_FILTER_INTERNAL_CFLAG)
 
-    def __setstate__(self, d: T.Dict) -> None:
-        self._personality = lib.pkgconf_cross_personality_default()
-        self.__add_paths(d['_paths'])
-        del d['_paths']
 
-        sysroot = d.get('_sysroot')
-        if sysroot:
-            del d['_sysroot']
+class PkgconfClient:
 
-        self.__dict__.update(d)
-        self.__init_client(self._options.debug)
+    def __init__(self, define_variables: T.Optional[T.Dict[str, str]] = None,
+                 with_paths: T.Optional[T.List[str]] = None, cache: bool = False,
+                 validate_cache: bool = False, profile: bool = False, memoize: int = 0,
+                 memoize_ttl: T.Optional[float] = None, disk_cache: T.Optional[str] = None, trace: int = 0,
+                 personality: T.Optional[str] = None, index: bool = False, **kwargs):
+        # The libpkgconf client is only created on first use, see __getattr__
+        self._search_path = SearchPath.get(with_paths, personality)
+        self._options = PkgconfFlags(**kwargs)
+        # with debug, libpkgconf traces go to a ring buffer, see trace()
+        self._trace_size = trace or (1024 if self._options.debug else 0)
+        self._diagnostics = ()
+        # name -> .pc file of each package lookup of the solves, when not None
+        self._lookups = None
+        self._use_index = index
+        self._index = None
+        self._index_walked = set()
+        self.__init_registry({})
+        self.__init_cache(cache, validate_cache)
+        self.__init_profile((True, 100) if profile else None)
+        self._disk_cache = DiskCache(disk_cache) if disk_cache else None
+        self.__init_memo(memoize, memoize_ttl)
+        self.__init_forks()
+
+        self._sysroot = None
+        self._variables = {}
+        if define_variables:
+            self.define_variables(**define_variables)
 
+    def __getattr__(self, name: str):
+        if name in ('_client', '_dir_key'):
+            self.__init_client()
+            return self.__dict__[name]
+        raise AttributeError(f'{type(self).__name__!r} object has no attribute {name!r}')
+
+    def __has_client(self) -> bool:
+        return '_client' in self.__dict__
+
+    def __init_client(self):
+        # Messages are buffered natively, errors are reset for each query
+        self.__errors = _MessageRing(32)
+        self.__trace = _MessageRing(self._trace_size)
+
+        personality = self._search_path._personality
+        client = lib.pkgconf_client_new(_ring_handler, self.__errors.ring, personality)
+        if self._trace_size:
+            lib.pkgconf_client_set_trace_handler(client, _ring_handler, self.__trace.ring)
+        sysroot = self._sysroot or self._search_path.sysroot
         if sysroot:
-            self.set_sysroot(sysroot)
+            lib.pkgconf_client_set_sysroot_dir(client, sysroot.encode())
+        for key, value in self._variables.items():
+            lib.pkgconf_tuple_define_global(client, f'{key}={value}'.encode())
+        if self._audit_file != ffi.NULL:
+            lib.pkgconf_audit_set_log(client, self._audit_file)
+        lib.pkgconf_client_set_flags(client, self._options.flags)
 
-        if self._variables:
-            self.define_variables(**self._variables)
+        # at this point, want_client_flags should be set, so build the dir list
+        lib.pkgconf_client_dir_list_build(client, personality)
+        self._dir_key = tuple(ffi.string(p.path).decode() for p in NodeIter(client.dir_list, 'pkgconf_path_t *'))
+        self._client = client
+
+    def __init_profile(self, profiling: T.Optional[T.Tuple[bool, int]]):
+        # Profiling is off unless _profile is set; the instrumented code
+        # paths only check it against None.
+        self._profiling = None
+        self._profile = None
+        self._audit_file = ffi.NULL
+        if profiling:
+            self.enable_profiling(*profiling)
+
+    def __init_memo(self, memoize: int, memoize_ttl: T.Optional[float]):
+        # Results are memoized with the cache key of the client state, so
+        # changing variables, options, sysroot or search path never returns
+        # results computed for another state.
+        # With a disk cache, results are also looked up and stored there.
+        self._memoize = (memoize, memoize_ttl)
+        self._memo = _ResultMemo(memoize, memoize_ttl) if memoize > 0 else None
+        self._memoizing = self._memo is not None or self._disk_cache is not None
+        self._solved_files = None
+
+    def __init_forks(self):
+        # clients of the forks with other variables, see _fork_client(), and
+        # the lock serializing the queries of the forks using this client
+        self._forks = weakref.WeakValueDictionary()
+        self._fork_lock = threading.RLock()
+
+    def __init_registry(self, registered: T.Dict[str, T.Tuple[bytes, str, int]]):
+        # name -> (source, filename, flags) of the packages registered without
+        # a file, and their parsed packages, pinned in the libpkgconf cache
+        self._registered = registered
+        self._registered_pkgs = {}
+        self._registered_key = None
+        # the digest combines a hash of each entry, so it is updated in constant time
+        self._registry_hashes = {name: _registry_hash(name, entry) for name, entry in registered.items()}
+        self._registry_xor = 0
+        for h in self._registry_hashes.values():
+            self._registry_xor ^= h
+        self._registry_digest = f'{self._registry_xor:064x}' if registered else None
+
+    def __init_cache(self, cache: bool, validate_cache: bool):
+        # When cache is enabled, parsed packages are kept in the libpkgconf
+        # cache between queries, as long as the cache key does not change.
+        # With validate_cache, the files of cached packages and the search
+        # directories are checked with stat before each query.
+        self._cache = cache
+        self._validate_cache = validate_cache
+        self._cache_key = None
+        self._cache_seen = {}
+        self._cache_dirs = {}
+        self._cache_stats = CacheStats()
+        self._graphs = {}
 
-        lib.pkgconf_client_set_flags(self._client, self._options.flags)
-        lib.pkgconf_client_dir_list_build(self._client, self._personality)
+    def __getstate__(self) -> object:
+        d = self.__dict__.copy()
+
+        for key in ('_client', '_dir_key', '_PkgconfClient__errors', '_PkgconfClient__trace', '_profile',
+                    '_audit_file', '_memo', '_solved_files', '_cache_key', '_cache_seen', '_cache_dirs', '_graphs',
+                    '_cache_stats', '_registered_pkgs', '_registered_key', '_registry_digest',
+                    '_registry_hashes', '_registry_xor', '_index',
+                    '_index_walked', '_forks', '_fork_lock'):
+            d.pop(key, None)
+        return d
+
+    def __setstate__(self, d: T.Dict) -> None:
+        self.__dict__.update(d)
+        self._diagnostics = ()
+        self._index = None
+        self._index_walked = set()
+        self.__init_registry(self._registered)
+        self.__init_cache(self._cache, self._validate_cache)
+        self.__init_profile(self._profiling)
+        self.__init_memo(*self._memoize)
+        self.__init_forks()
     
     def __del__(self):
-        if hasattr(self, '_personality'):
-            lib.pkgconf_cross_personality_deinit(self._personality)
-        
-        if hasattr(self, '_client'):
+        if self.__has_client():
+            # owned by the client, so released before it
+            for pkg in self._registered_pkgs.values():
+                lib.pkgconf_pkg_unref(self._client, pkg)
             lib.pkgconf_client_free(self._client)
 
+        if self.__dict__.get('_audit_file', ffi.NULL) != ffi.NULL:
+            lib.fclose(self._audit_file)
+
     def version(self) -> T.Optional[str]:
         return self.modversion('pkgconf')
 
     def define_variables(self, **variables) -> None:
         self._variables.update(variables)
-        for key, value in variables.items():
-            lib.pkgconf_tuple_define_global(self._client, f'{key}={value}'.encode())
+        if self.__has_client():
+            for key, value in variables.items():
+                lib.pkgconf_tuple_define_global(self._client, f'{key}={value}'.encode())
 
     def set_options(self, **options) -> bool:
         if self._options.update(**options):
-            lib.pkgconf_client_set_flags(self._client, self._options.flags)
-            lib.pkgconf_cache_free(self._client)
+            if self.__has_client():
+                lib.pkgconf_client_set_flags(self._client, self._options.flags)
             return True
         return False
     
-    def set_sysroot(self, sysroot: str) -> None:
-        lib.pkgconf_client_set_sysroot_dir(sysroot.encode())
+    def set_sysroot(self, sysroot: T.Optional[str]) -> None:
+        self._sysroot = sysroot
+        if self.__has_client():
+            sysroot = sysroot or self._search_path.sysroot
+            lib.pkgconf_client_set_sysroot_dir(self._client, sysroot.encode() if sysroot else ffi.NULL)
+
+    def fork(self, define_variables: T.Optional[T.Dict[str, str]] = None, **options) -> ClientFork:
+        """Lightweight variant of this client, with more variables or other options.
+
+        The variables and options are the ones of this client, updated with
+        the given ones. See ClientFork.
+        """
+        return ClientFork(self, {**self._variables, **(define_variables or {})},
+                          _fork_options(self._options, options))
+
+    def _fork_client(self, variables: T.Dict[str, str],
+                     current: T.Optional[PkgconfClient] = None) -> PkgconfClient:
+        """The client running the queries of the forks with these variables.
+
+        It is this client if the variables are the same, or else a client
+        shared by the forks with these variables, created from the current
+        state of this one. `current` is the client used by the fork before.
+        """
+        if variables == self._variables:
+            return self
+
+        def valid(client: T.Optional[PkgconfClient]) -> bool:
+            return (client is not None and client is not self and client._variables == variables
+                    and client._sysroot == self._sysroot and client._registry_digest == self._registry_digest)
+
+        if valid(current):
+            return current
+        key = tuple(sorted(variables.items()))
+        with self._fork_lock:
+            client = self._forks.get(key)
+            if not valid(client):
+                state = self.__getstate__()
+                state['_options'] = copy.copy(self._options)
+                state['_variables'] = dict(variables)
+                state['_registered'] = dict(self._registered)
+                client = type(self).__new__(type(self))
+                client.__setstate__(state)
+                # memoized results are keyed with the whole client state
+                client._memo = self._memo
+                if self._use_index:
+                    client._index = self.__package_index()
+                self._forks[key] = client
+        return client
+
+    def register_package(self, name: str, source: T.Union[str, bytes, T.Mapping[str, T.Any]],
+                         pcfiledir: str = '.', uninstalled: bool = False) -> None:
+        """Make a package available without a .pc file.
+
+        `source` is the content of a .pc file, or a mapping of its fields with
+        an optional 'variables' mapping, see pc_source(). Registered packages
+        are found before the ones of the search path, and are kept parsed
+        in memory, even if the cache is disabled. `pcfiledir` is the value of
+        the ${pcfiledir} variable. Raises ValueError if the package is invalid.
+        """
+        entry = self.__registry_entry(name, source, pcfiledir, uninstalled)
+        self.__update_registry({name: (entry, self.__parse_checked(name, entry))})
+
+    def register_packages(self, packages: T.Mapping[str, T.Union[str, bytes, T.Mapping[str, T.Any]]],
+                          pcfiledir: str = '.', uninstalled: bool = False) -> None:
+        """Register several packages at once, see register_package().
+
+        The package cache is only flushed once. If a package is invalid,
+        ValueError is raised and none of them is registered.
+        """
+        updates = {}
+        try:
+            for name, source in packages.items():
+                entry = self.__registry_entry(name, source, pcfiledir, uninstalled)
+                updates[name] = (entry, self.__parse_checked(name, entry))
+        except BaseException:
+            for _, pkg in updates.values():
+                lib.pkgconf_pkg_unref(self._client, pkg)
+            raise
+        self.__update_registry(updates)
+
+    def unregister_package(self, name: str) -> None:
+        if name not in self._registered:
+            raise KeyError(name)
+        self.__update_registry({name: None})
+
+    def registered_packages(self) -> T.List[str]:
+        return list(self._registered)
+
+    def __registry_entry(self, name: str, source: T.Union[str, bytes, T.Mapping[str, T.Any]],
+                         pcfiledir: str, uninstalled: bool) -> T.Tuple[bytes, str, int]:
+        if isinstance(source, str):
+            source = source.encode()
+        elif not isinstance(source, bytes):
+            source = pc_source(name, source)
+        suffix = '-uninstalled.pc' if uninstalled else '.pc'
+        return (source, os.path.join(pcfiledir, name + suffix), flags.PROPF_UNINSTALLED if uninstalled else 0)
+
+    def __parse_checked(self, name: str, entry: T.Tuple[bytes, str, int]):
+        pkg = self.__parse_registered(name, entry)
+        if pkg == ffi.NULL:
+            details = '; '.join(self.__errors.lines())
+            raise ValueError(f'invalid package {name!r}' + (f': {details}' if details else ''))
+        return pkg
+
+    def __update_registry(self, updates: T.Dict[str, T.Optional[T.Tuple[T.Tuple[bytes, str, int], T.Any]]]) -> None:
+        # the packages were parsed with the current parse key, the others may need to be parsed again
+        key = self._parse_key()
+        if not self._registered_pkgs or self._registered_key == key:
+            self._registered_key = key
+
+        old = []
+        for name, update in updates.items():
+            pkg = self._registered_pkgs.pop(name, None)
+            if pkg is not None:
+                old.append(pkg)
+            if name in self._registered:
+                del self._registered[name]
+                self._registry_xor ^= self._registry_hashes.pop(name)
+            if update is not None:
+                entry, pkg = update
+                self._registered[name] = entry
+                self._registered_pkgs[name] = pkg
+                self._registry_hashes[name] = _registry_hash(name, entry)
+                self._registry_xor ^= self._registry_hashes[name]
+        self._registry_digest = f'{self._registry_xor:064x}' if self._registered else None
+
+        # the replaced packages are not pinned anymore, so they leave the cache
+        self.clear_cache()
+        for pkg in old:
+            lib.pkgconf_pkg_unref(self._client, pkg)
+
+    def __parse_registered(self, name: str, entry: T.Tuple[bytes, str, int]):
+        source, filename, pkg_flags = entry
+        client = self._client
+        self.__errors.clear()
+        stream = lib.pypkgconf_memory_stream(source, len(source))
+        if stream == ffi.NULL:
+            raise OSError(ffi.errno, os.strerror(ffi.errno))
+        # the stream is closed by the parser
+        pkg = lib.pkgconf_pkg_new_from_file(client, filename.encode(), stream, pkg_flags)
+        if pkg != ffi.NULL and ffi.string(pkg.id) != name.encode():
+            lib.pkgconf_pkg_unref(client, pkg)
+            raise ValueError(f'invalid package name {name!r}')
+        return pkg
+
+    def __load_registered(self) -> None:
+        if not self._registered:
+            return
+
+        # registered packages are parsed again when the variables, sysroot or flags change
+        key = self._parse_key()
+        if key != self._registered_key:
+            old = list(self._registered_pkgs.values())
+            self._registered_pkgs = {}
+            self.__free_cache()
+            for pkg in old:
+                lib.pkgconf_pkg_unref(self._client, pkg)
+            for name, entry in self._registered.items():
+                pkg = self.__parse_registered(name, entry)
+                if pkg != ffi.NULL:
+                    self._registered_pkgs[name] = pkg
+            self._registered_key = key
+
+        for pkg in self._registered_pkgs.values():
+            if not pkg.flags & flags.PROPF_CACHED:
+                lib.pkgconf_cache_add(self._client, pkg)
+
+    def cache_stats(self) -> CacheStats:
+        self._cache_stats.size = self._client.cache_count
+        return replace(self._cache_stats)
+
+    def enable_profiling(self, audit: bool = True, history: int = 100) -> None:
+        """Start collecting timers and counters, see stats().
+
+        With audit, the libpkgconf audit log is captured to attribute the
+        resolved dependencies to each query. At most `history` queries are
+        kept in ProfileStats.recent.
+        """
+        self.disable_profiling()
+        self._profiling = (audit, history)
+        self.__set_profile(ProfileStats(recent=deque(maxlen=history)))
+        if audit:
+            self._audit_file = lib.tmpfile()
+            if self._audit_file != ffi.NULL and self.__has_client():
+                lib.pkgconf_audit_set_log(self._client, self._audit_file)
+
+    def disable_profiling(self) -> None:
+        self._profiling = None
+        self.__set_profile(None)
+        if self._audit_file != ffi.NULL:
+            if self.__has_client():
+                lib.pkgconf_audit_set_log(self._client, ffi.NULL)
+            lib.fclose(self._audit_file)
+            self._audit_file = ffi.NULL
+
+    def stats(self) -> T.Optional[ProfileStats]:
+        """Snapshot of the profiling data, or None if profiling is disabled."""
+        if self._profile is None:
+            return None
+        return replace(self._profile, recent=list(self._profile.recent))
+
+    def reset_stats(self) -> None:
+        if self._profile is not None:
+            self.__set_profile(ProfileStats(recent=deque(maxlen=self._profiling[1])))
+
+    def __set_profile(self, profile: T.Optional[ProfileStats]) -> None:
+        self._profile = profile
+
+    def __read_audit_log(self) -> T.Tuple[str, ...]:
+        # The log is rewound after each query, so it only holds the lines
+        # written since the previous read.
+        f = self._audit_file
+        lib.fflush(f)
+        size = lib.ftell(f)
+        lib.rewind(f)
+        if size <= 0:
+            return ()
+        buf = ffi.new('char[]', size)
+        size = lib.fread(buf, 1, size, f)
+        lib.rewind(f)
+        return tuple(ffi.unpack(buf, size).decode(errors='replace').splitlines())
+
+    def __profile_solve(self, world, loaded_before, elapsed: float) -> T.Tuple[str, ...]:
+        profile = self._profile
+        profile.queries += 1
+        profile.solve_time += elapsed
+
+        if world is not None:
+            for deps in (world.required, world.requires_private):
+                for dep in NodeIter(deps, 'pkgconf_dependency_t *'):
+                    if dep.match in loaded_before:
+                        profile.cache_hits += 1
+
+        files = []
+        for i in range(self._client.cache_count):
+            pkg = self._client.cache_table[i]
+            if pkg not in loaded_before:
+                profile.packages_loaded += 1
+                profile.cache_misses += 1
+                if pkg.filename != ffi.NULL:
+                    files.append(ffi.string(pkg.filename).decode(errors='replace'))
+        return tuple(files)
+
+    def memo_stats(self) -> T.Optional[MemoStats]:
+        """Hit rate of the result memoization, or None if it is disabled."""
+        if self._memo is None:
+            return None
+        self._memo.stats.size = len(self._memo.entries)
+        return replace(self._memo.stats)
+
+    def clear_cache(self) -> None:
+        self.__reset_cache()
+        self._graphs.clear()
+        if self._memo is not None:
+            self._memo.clear()
+
+    def __memoized(self, key: T.Tuple, func, *args):
+        key = (key, self.__cache_key(), self._options.flags, self._options.maximum_traverse_depth)
+        if self._memo is not None:
+            if self._cache and self._validate_cache and key[1] == self._cache_key:
+                # drops the memoized results if a .pc file changed since
+                self.refresh_cache()
+            value = self._memo.get(key)
+            if value is not _MISSING:
+                return value
+
+        # results of Python predicates cannot be reused by other processes
+        disk_key = None
+        if self._disk_cache is not None and not any(isinstance(k, FragmentFilter) and k.predicate for k in key[0]):
+            disk_key = self.__disk_key(key)
+            value = self._disk_cache.get(disk_key, _MISSING)
+            if value is not _MISSING:
+                if self._memo is not None:
+                    self._memo.put(key, value)
+                return value
+
+        if disk_key is None:
+            value = func(*args)
+        else:
+            self._solved_files = set()
+            try:
+                value = func(*args)
+                deps = [(f, stat_key(f)) for f in sorted(self._solved_files)]
+            finally:
+                self._solved_files = None
+            deps.extend(self.__stat_dirs().items())
+            self._disk_cache.put(disk_key, deps, value)
+
+        if self._memo is not None:
+            self._memo.put(key, value)
+        return value
+
+    def __disk_key(self, key: T.Tuple) -> str:
+        return repr((key, self._filter_dirs(), self._registry_digest, _EXTENSION_KEY))
+
+    def _filter_dirs(self) -> T.Tuple[T.Tuple[str, ...], T.Tuple[str, ...]]:
+        """System library and include directories, filtered out of the results"""
+        return tuple(tuple(ffi.string(p.path).decode() for p in NodeIter(dirs, 'pkgconf_path_t *'))
+                     for dirs in (self._client.filter_libdirs, self._client.filter_includedirs))
+
+    def __reset_cache(self) -> None:
+        self.__free_cache()
+        self._cache_key = None
+        self._cache_seen.clear()
+        self._cache_dirs.clear()
+
+    def __cache_key(self) -> T.Tuple:
+        # Everything that can change the result of parsing a .pc file
+        return self._parse_key() + (self._dir_key, self._registry_digest)
+
+    def _parse_key(self) -> T.Tuple:
+        """Everything but the search path that can change the result of parsing a .pc file"""
+        return (
+            lib.pkgconf_client_get_flags(self._client) & ~_SOLVE_FLAGS,
+            tuple(sorted(self._variables.items())),
+            self._sysroot or self._search_path.sysroot,
+        )
+
+    def __free_cache(self) -> None:
+        self._index_walked.clear()
+        if self._registered_pkgs:
+            self.__retain_registered()
+        else:
+            lib.pkgconf_cache_free(self._client)
+
+    def __retain_registered(self) -> None:
+        # Registered packages stay in the cache, their dependencies are looked up again
+        pinned = ffi.new('pkgconf_pkg_t *[]', list(self._registered_pkgs.values()))
+        lib.pypkgconf_cache_retain(self._client, pinned, len(pinned))
+
+    def __prepare_cache(self) -> None:
+        if not self._cache:
+            self.__free_cache()
+            self.__load_registered()
+            return
+
+        key = self.__cache_key()
+        if key != self._cache_key:
+            self.__reset_cache()
+            self.__load_registered()
+            self._cache_key = key
+            self._cache_dirs = self.__stat_dirs()
+            return
+
+        if self._validate_cache:
+            self.refresh_cache()
+        self.__load_registered()
+
+        # The solver orders the flattened solution using the hits counter
+        # of each package, so cached packages must look freshly loaded.
+        table = self._client.cache_table
+        for i in range(self._client.cache_count):
+            table[i].hits = 0
+
+    def __update_cache_stats(self, world) -> None:
+        # A package of the solution is a hit if it was already in the cache
+        # before this query. New packages in the cache table are misses.
+        for deps in (world.required, world.requires_private):
+            for dep in NodeIter(deps, 'pkgconf_dependency_t *'):
+                if dep.match in self._cache_seen:
+                    self._cache_stats.hits += 1
+
+        if self._client.cache_count != len(self._cache_seen):
+            for i in range(self._client.cache_count):
+                pkg = self._client.cache_table[i]
+                if pkg not in self._cache_seen:
+                    self._cache_seen[pkg] = stat_key(ffi.string(pkg.filename)) if pkg.filename != ffi.NULL else None
+                    self._cache_stats.misses += 1
+
+    def __stat_dirs(self) -> T.Dict[str, StatKey]:
+        return {d: stat_key(d) for d in self._dir_key}
+
+    def refresh_cache(self) -> int:
+        """Remove stale packages from the cache, and return how many were removed.
+
+        A package is stale if its file changed, or if a search directory
+        with the same or a higher priority than its own directory changed,
+        since it could now be found elsewhere. Packages depending on a stale
+        package are stale too, because they keep a reference to it.
+        """
+        dirs = self.__stat_dirs()
+        changed_dirs = [i for i, d in enumerate(self._dir_key) if dirs[d] != self._cache_dirs.get(d)]
+        self._cache_dirs = dirs
+        first_changed = min(changed_dirs, default=len(self._dir_key))
+
+        stale = set()
+        registered = set(self._registered_pkgs.values())
+        packages = [self._client.cache_table[i] for i in range(self._client.cache_count)]
+        for pkg in packages:
+            if pkg in registered:
+                continue
+            stat = stat_key(ffi.string(pkg.filename)) if pkg.filename != ffi.NULL else None
+            if stat != self._cache_seen.get(pkg):
+                stale.add(pkg)
+            elif changed_dirs:
+                pc_filedir = ffi.string(pkg.pc_filedir).decode() if pkg.pc_filedir != ffi.NULL else None
+                try:
+                    if self._dir_key.index(pc_filedir) >= first_changed:
+                        stale.add(pkg)
+                except ValueError:
+                    stale.add(pkg)
+
+        # propagate to the packages whose dependencies match a stale package
+        changed = bool(stale)
+        while changed:
+            changed = False
+            for pkg in packages:
+                if pkg in stale:
+                    continue
+                for deps in (pkg.required, pkg.requires_private, pkg.conflicts):
+                    if any(dep.match in stale for dep in NodeIter(deps, 'pkgconf_dependency_t *')):
+                        if pkg in registered:
+                            # registered packages are kept, only their dependencies are looked up again
+                            lib.pypkgconf_pkg_unmatch(self._client, pkg, ffi.NULL, 0)
+                            break
+                        stale.add(pkg)
+                        changed = True
+                        break
+
+        for pkg in stale:
+            self._cache_seen.pop(pkg, None)
+            lib.pkgconf_cache_remove(self._client, pkg)
+        if stale:
+            self._index_walked.clear()
+        if stale or changed_dirs:
+            self._graphs.clear()
+            if self._memo is not None:
+                self._memo.clear()
+        return len(stale)
         
     @contextmanager
     def variables_ctx(self, **kwargs):
         current_variables = self._variables.copy()
         self.define_variables(**kwargs)
 
-        yield
-
-        lib.pkgconf_tuple_free_global(self._client)
-        self._variables = {}
-        self.define_variables(**current_variables)
+        try:
+            yield
+        finally:
+            lib.pkgconf_tuple_free_global(self._client)
+            self._variables = {}
+            self.define_variables(**current_variables)
 
     @contextmanager
     def options_ctx(self, **kwargs):
-        current_flags = self._options.flags
+        # copied, since replace() would apply the environment again
+        current_options = copy.copy(self._options)
         modified = self.set_options(**kwargs)
 
-        yield
-
-        if modified:
-            lib.pkgconf_client_set_flags(self._client, current_flags)
-            lib.pkgconf_cache_free(self._client)
+        try:
+            yield
+        finally:
+            if modified:
+                self._options = current_options
+                lib.pkgconf_client_set_flags(self._client, current_options.flags)
     
+    def __log_errors(self) -> None:
+        # each call logs its own messages, they must not leak into the next one
+        if len(self.__errors):
+            logger.error('\n'.join(self.__errors.lines()))
+            self.__errors.clear()
+
     @contextmanager
     def _solve(self, packages: T.List[str], maximum_traverse_depth=None):
-        lib.pkgconf_cache_free(self._client)
+        self.__prepare_cache()
+        self.__errors.clear()
+
+        profile = self._profile
+        if profile is not None:
+            loaded_before = {self._client.cache_table[i] for i in range(self._client.cache_count)}
+            start = time.perf_counter()
 
         world = ffi.new('pkgconf_pkg_t *')
-        id = ffi.new('char[]', 'virtual:world'.encode())
-        world.id = id
-        realname = ffi.new('char[]', 'virtual world package'.encode())
-        world.realname = realname
+        world.id = _WORLD_ID
+        world.realname = _WORLD_REALNAME
         world.flags = flags.PROPF_STATIC | flags.PROPF_VIRTUAL
     
         pkgq = ffi.new("pkgconf_list_t *")
@@ -277,12 +1296,188 @@ class PkgconfClient:
 
         if maximum_traverse_depth is None:
             maximum_traverse_depth = self._options.maximum_traverse_depth
+        if self._use_index:
+            self.__preload(packages, maximum_traverse_depth)
         r = lib.pkgconf_queue_solve(self._client, pkgq, world, maximum_traverse_depth)
-        
-        yield world if r else None
+        if r and self._cache:
+            self.__update_cache_stats(world)
+        if r and self._solved_files is not None:
+            for deps in (world.required, world.requires_private):
+                for dep in NodeIter(deps, 'pkgconf_dependency_t *'):
+                    if dep.match != ffi.NULL and dep.match.filename != ffi.NULL:
+                        self._solved_files.add(ffi.string(dep.match.filename).decode())
+        if r and self._lookups is not None:
+            self.__record_lookups(world)
+        if profile is not None:
+            files = self.__profile_solve(world if r else None, loaded_before, time.perf_counter() - start)
+        self._diagnostics = () if r else self.__diagnose(pkgq, maximum_traverse_depth)
+        if not r and self._solved_files is not None:
+            # a failure depends on the packages that were found, whether they
+            # were rejected or not: all the loaded ones are recorded
+            for i in range(self._client.cache_count):
+                pkg = self._client.cache_table[i]
+                if pkg.filename != ffi.NULL:
+                    self._solved_files.add(ffi.string(pkg.filename).decode())
+
+        try:
+            yield world if r else None
+        finally:
+            self.__log_errors()
+
+            lib.pkgconf_solution_free(self._client, world)
+            lib.pkgconf_queue_free(pkgq)
+
+            if profile is not None:
+                audit = self.__read_audit_log() if self._audit_file != ffi.NULL else ()
+                profile.recent.append(QueryProfile(tuple(packages), files, audit))
+
+    def __package_index(self) -> _PackageIndex:
+        uninstalled = not lib.pkgconf_client_get_flags(self._client) & flags.PKGF_NO_UNINSTALLED
+        index = self._index
+        if index is None or index.dirs != self._dir_key or index.uninstalled != uninstalled:
+            index = self._index = _PackageIndex(self._dir_key, uninstalled)
+            self._index_walked.clear()
+        elif index.changed():
+            index.build()
+            self._index_walked.clear()
+        return index
+
+    def __preload(self, packages: T.List[str], maximum_traverse_depth: int) -> None:
+        """Load the packages of a solve from the index, so libpkgconf finds them in its cache
+        instead of probing each directory of the search path."""
+        client = self._client
+        client_flags = lib.pkgconf_client_get_flags(client)
+        if client_flags & flags.PKGF_NO_CACHE:
+            return
+
+        index = self.__package_index()
+
+        # (package, private) when its dependencies were all loaded, with
+        # Requires.private ones if private
+        private = bool(client_flags & flags.PKGF_SEARCH_PRIVATE)
+        walked = self._index_walked
+        pending = [(name, 1) for name in self._requested_names(packages)]
+        visited = {}
+        truncated = False
+        while pending:
+            name, depth = pending.pop()
+            if name in visited:
+                continue
+            visited[name] = None
+
+            pkg = lib.pkgconf_cache_lookup(client, name.encode())
+            if pkg == ffi.NULL:
+                path, is_uninstalled = index.files.get(name, (None, False))
+                f = lib.fopen(path.encode(), b'r') if path else ffi.NULL
+                if f == ffi.NULL:
+                    continue
+                # the file is closed by the parser
+                pkg = lib.pkgconf_pkg_new_from_file(client, path.encode(), f,
+                                                    flags.PROPF_UNINSTALLED if is_uninstalled else 0)
+                if pkg == ffi.NULL:
+                    continue
+                lib.pkgconf_cache_add(client, pkg)
+            elif (pkg, private) in walked or (pkg, True) in walked:
+                lib.pkgconf_pkg_unref(client, pkg)
+                continue
+
+            if 0 < maximum_traverse_depth <= depth:
+                truncated = True
+            else:
+                visited[name] = pkg
+                for deps in ((pkg.required, pkg.requires_private) if private else (pkg.required,)):
+                    for dep in NodeIter(deps, 'pkgconf_dependency_t *'):
+                        pending.append((ffi.string(dep.package).decode(), depth + 1))
+            lib.pkgconf_pkg_unref(client, pkg)
+
+        if not truncated:
+            walked.update((pkg, private) for pkg in visited.values() if pkg is not None)
+
+    def __record_lookups(self, world) -> None:
+        # The flattened solution only has package ids, so the names are
+        # taken from the dependencies of each package of the solution.
+        for deps in (world.required, world.requires_private):
+            for dep in NodeIter(deps, 'pkgconf_dependency_t *'):
+                for pkg_deps in (dep.match.required, dep.match.requires_private):
+                    for pkg_dep in NodeIter(pkg_deps, 'pkgconf_dependency_t *'):
+                        if pkg_dep.match != ffi.NULL:
+                            name = ffi.string(pkg_dep.package).decode()
+                            self._lookups[name] = _optional_string(pkg_dep.match.filename)
+
+    def __diagnose(self, pkgq, maximum_traverse_depth: int) -> T.Tuple[Diagnostic, ...]:
+        """Verify the dependencies of a failed solve again, collecting why they failed"""
+        world = ffi.new('pkgconf_pkg_t *')
+        world.id = _WORLD_ID
+        world.realname = _WORLD_REALNAME
+        world.flags = flags.PROPF_STATIC | flags.PROPF_VIRTUAL
+        if not lib.pkgconf_queue_compile(self._client, world, pkgq):
+            lib.pkgconf_solution_free(self._client, world)
+            return (Diagnostic(flags.ERRF_DEPGRAPH_BREAK),)
+
+        client_flags = lib.pkgconf_client_get_flags(self._client)
+        static = bool(client_flags & flags.PKGF_SEARCH_PRIVATE)
+        eflags = ffi.new('unsigned int *')
+        diagnostics = []
+
+        def verify(dep):
+            # pkgconf_pkg_verify_dependency returns a new reference, the cache keeps the package alive
+            eflags[0] = flags.ERRF_OK
+            pkg = lib.pkgconf_pkg_verify_dependency(self._client, dep, eflags)
+            version = ffi.string(pkg.version).decode() if pkg != ffi.NULL and pkg.version != ffi.NULL else None
+            if pkg != ffi.NULL:
+                lib.pkgconf_pkg_unref(self._client, pkg)
+            return pkg, eflags[0], version
+
+        def constraint(dep) -> str:
+            if dep.version == ffi.NULL:
+                return ffi.string(dep.package).decode()
+            return ' '.join(ffi.string(s).decode() for s in (dep.package, lib.pkgconf_pkg_get_comparator(dep),
+                                                             dep.version))
+
+        seen = set()
+        stack = [(world, 0)]
+        while stack:
+            parent, depth = stack.pop()
+            if maximum_traverse_depth > 0 and depth >= maximum_traverse_depth:
+                continue
+            required_by = ffi.string(parent.id).decode() if parent != world else None
+
+            for deps in ((parent.required, parent.requires_private) if static else (parent.required,)):
+                for dep in NodeIter(deps, 'pkgconf_dependency_t *'):
+                    pkg, code, version = verify(dep)
+                    if code != flags.ERRF_OK:
+                        diagnostics.append(Diagnostic(code, ffi.string(dep.package).decode(), constraint(dep),
+                                                      required_by, version))
+                    elif pkg not in seen:
+                        seen.add(pkg)
+                        stack.append((pkg, depth + 1))
+
+            if client_flags & flags.PKGF_SKIP_CONFLICTS or parent == world:
+                continue
+            # like libpkgconf, conflicts are checked against the direct requirements
+            required = {ffi.string(dep.package) for dep in NodeIter(parent.required, 'pkgconf_dependency_t *')}
+            for rule in NodeIter(parent.conflicts, 'pkgconf_dependency_t *'):
+                if ffi.string(rule.package) not in required:
+                    continue
+                pkg, code, version = verify(rule)
+                if code == flags.ERRF_OK:
+                    diagnostics.append(Diagnostic(flags.ERRF_PACKAGE_CONFLIC, ffi.string(rule.package).decode(),
+                                                  constraint(rule), required_by, version))
 
         lib.pkgconf_solution_free(self._client, world)
-        lib.pkgconf_queue_free(pkgq)
+        return tuple(diagnostics) or (Diagnostic(flags.ERRF_DEPGRAPH_BREAK),)
+
+    def diagnostics(self) -> T.Tuple[Diagnostic, ...]:
+        """Why the last query of this client failed, empty if it succeeded"""
+        return self._diagnostics
+
+    def trace(self) -> T.List[str]:
+        """Last messages traced by libpkgconf, oldest first.
+
+        Tracing is enabled by the `trace` argument, or with `debug`. The
+        buffer keeps a bounded number of lines.
+        """
+        return self.__trace.lines() if self.__has_client() else []
 
     def _iter_world(self, packages: T.List[str], maximum_traverse_depth=None):
         with self._solve(packages, maximum_traverse_depth) as world:
@@ -291,6 +1486,11 @@ class PkgconfClient:
                     yield pkg_dep.match
 
     def modversion(self, package: str) -> T.Optional[str]:
+        if self._memoizing:
+            return self.__memoized(('modversion', package), self._modversion, package)
+        return self._modversion(package)
+
+    def _modversion(self, package: str) -> T.Optional[str]:
         version = []
         
         for pkg in self._iter_world([package], maximum_traverse_depth=1):
@@ -299,59 +1499,488 @@ class PkgconfClient:
         
         return "\n".join(version) if version else None
 
-    def cflags(self, packages: T.Union[str, T.List[str]], **kwargs) -> T.Optional[str]:
+    def package(self, package: str) -> T.Optional[PackageView]:
+        """Lazy view of a package, or None if it is not found."""
+        views = [PackageView(self, pkg) for pkg in self._iter_world([package], maximum_traverse_depth=1)]
+        return views[0] if views else None
+
+    def solution(self, packages: T.Union[str, T.List[str]]) -> T.Optional[T.List[PackageView]]:
+        """Lazy views of all the packages of the solution, in link order.
+
+        Returns None if the packages cannot be solved.
+        """
         if isinstance(packages, str):
             packages = [packages]
         with self._solve(packages) as world:
             if not world:
                 return None
-            
-            unfiltered_list = ffi.new('pkgconf_list_t *')
-            filtered_list = ffi.new('pkgconf_list_t *')
+            return [PackageView(self, dep.match) for dep in NodeIter(world.required, 'pkgconf_dependency_t *')]
+
+    def check_constraints(self, constraints: T.Iterable[Constraint]) -> ConstraintResults:
+        """Check many version constraints at once, like --atleast-version and friends.
+
+        Each distinct package is looked up once, without solving its
+        dependencies, and all the versions are compared in a single native call.
+        """
+        constraints = tuple(constraints)
+        self.__prepare_cache()
+        self.__errors.clear()
+
+        deps = ffi.new('pkgconf_list_t *')
+        lookups = ffi.new('pkgconf_list_t *')
+        found = {}
+        try:
+            for constraint in constraints:
+                length = deps.length
+                if isinstance(constraint, str):
+                    lib.pkgconf_dependency_parse_str(self._client, deps, constraint.encode(), 0)
+                else:
+                    if len(constraint) == 1:
+                        name, comparator, version = constraint[0], '', None
+                    elif len(constraint) == 3:
+                        name, comparator, version = constraint
+                    else:
+                        raise ValueError(f'invalid constraint {constraint!r}')
+                    if comparator not in COMPARATORS or bool(comparator) != bool(version):
+                        raise ValueError(f'invalid constraint {constraint!r}')
+                    compare = COMPARATORS.index(comparator) if version else lib.PKGCONF_CMP_ANY
+                    lib.pkgconf_dependency_add(self._client, deps, name.encode(),
+                                               version.encode() if version else ffi.NULL, compare, 0)
+                if deps.length != length + 1:
+                    raise ValueError(f'invalid constraint {constraint!r}')
+
+            eflags = ffi.new('unsigned int *')
+            versions = ffi.new('const char *[]', deps.length)
+            for i, dep in enumerate(NodeIter(deps, 'pkgconf_dependency_t *')):
+                name = ffi.string(dep.package)
+                pkg = found.get(name)
+                if pkg is None:
+                    lookup = lib.pkgconf_dependency_add(self._client, lookups, dep.package, ffi.NULL,
+                                                        lib.PKGCONF_CMP_ANY, 0)
+                    pkg = found[name] = lib.pkgconf_pkg_verify_dependency(self._client, lookup, eflags)
+                if pkg != ffi.NULL:
+                    versions[i] = pkg.version if pkg.version != ffi.NULL else _EMPTY_VERSION
+
+            results = ffi.new('signed char[]', deps.length)
+            lib.pypkgconf_check_versions(deps, versions, results)
+            packed = array('b')
+            packed.frombytes(ffi.buffer(results))
+
+            return ConstraintResults(
+                constraints,
+                packed,
+                {name.decode(): (_optional_string(pkg.version) or '') if pkg != ffi.NULL else None
+                 for name, pkg in found.items()},
+            )
+        finally:
+            for pkg in found.values():
+                if pkg != ffi.NULL:
+                    lib.pkgconf_pkg_unref(self._client, pkg)
+            lib.pkgconf_dependency_free(lookups)
+            lib.pkgconf_dependency_free(deps)
+            self.__log_errors()
+
+    def _filtered_cflags(self, world, flt: FragmentFilter):
+        return self._filtered(world, flt, lib.pkgconf_pkg_cflags, lib.filter_cflags)
+
+    def _filtered_libs(self, world, flt: FragmentFilter):
+        return self._filtered(world, flt, lib.pkgconf_pkg_libs, lib.filter_libs)
 
-            try:
-                eflag = lib.pkgconf_pkg_cflags(self._client, world, unfiltered_list, 2)
-                if eflag != flags.ERRF_OK:
-                    return None
-                
-                kwargs.setdefault('keep_system', os.environ.get('PKG_CONFIG_ALLOW_SYSTEM_CFLAGS', False))
-                data = ffi.new_handle(CflagFilterData(**kwargs))
-                lib.pkgconf_fragment_filter(self._client, filtered_list, unfiltered_list, lib.filter_cflags, data)
-
-                result_str = lib.pkgconf_fragment_render(filtered_list, False, ffi.NULL)
-                return ffi.string(result_str).decode()
+    @contextmanager
+    def _filtered(self, world, flt: FragmentFilter, collect, python_filter):
+        unfiltered_list = ffi.new('pkgconf_list_t *')
+        filtered_list = ffi.new('pkgconf_list_t *')
+        profile = self._profile
+
+        try:
+            if profile is not None:
+                start = time.perf_counter()
+            eflag = collect(self._client, world, unfiltered_list, 2)
+            if profile is not None:
+                profile.collect_time += time.perf_counter() - start
+            if eflag != flags.ERRF_OK:
+                yield None
+                return
             
-            finally:
-                lib.pkgconf_fragment_free(filtered_list)
-                lib.pkgconf_fragment_free(unfiltered_list)
+            counter = None
+            if profile is not None:
+                start = time.perf_counter()
+                if flt.predicate is not None:
+                    counter = _PredicateCalls(flt)
+            _fragment_filter(self._client, filtered_list, unfiltered_list, flt, python_filter, counter)
+            if profile is not None:
+                profile.filter_time += time.perf_counter() - start
+                profile.fragments_collected += unfiltered_list.length
+                profile.fragments_filtered += unfiltered_list.length - filtered_list.length
+                if counter is not None:
+                    profile.callbacks += counter.calls
+
+            yield filtered_list
+        
+        finally:
+            lib.pkgconf_fragment_free(filtered_list)
+            lib.pkgconf_fragment_free(unfiltered_list)
+
+    def _render_cflags(self, world, flt: FragmentFilter) -> T.Optional[str]:
+        with self._filtered_cflags(world, flt) as fragment_list:
+            return None if fragment_list is None else self._render(fragment_list, False)
+
+    def _render_libs(self, world, flt: FragmentFilter) -> T.Optional[str]:
+        with self._filtered_libs(world, flt) as fragment_list:
+            return None if fragment_list is None else self._render(fragment_list, True)
+
+    def _render(self, fragment_list, escape: bool) -> str:
+        if self._profile is not None:
+            start = time.perf_counter()
+        buf_len = lib.pkgconf_fragment_render_len(fragment_list, escape, ffi.NULL)
+        buf = ffi.new('char[]', buf_len)
+        lib.pkgconf_fragment_render_buf(fragment_list, buf, buf_len, escape, ffi.NULL)
+        if self._profile is not None:
+            self._profile.render_time += time.perf_counter() - start
+        return ffi.string(buf).decode()
+
+    def _fragments(self, fragment_list, as_args: bool, dedup: bool) -> Fragments:
+        if self._profile is not None:
+            start = time.perf_counter()
+        fragments = []
+        for frag in NodeIter(fragment_list, 'pkgconf_fragment_t *'):
+            type = sys.intern(frag.type.decode()) if frag.type != b'\0' else ''
+            data = sys.intern(ffi.string(frag.data).decode()) if frag.data != ffi.NULL else ''
+            fragments.append((type, data, frag.merged))
+
+        if dedup:
+            # like pkg-config, libraries keep their last occurrence, so that
+            # they still come after the ones depending on them; the others
+            # keep their first occurrence
+            last = {(type, data): i for i, (type, data, _) in enumerate(fragments) if type == 'l'}
+            seen = set()
+            kept = []
+            for i, (type, data, merged) in enumerate(fragments):
+                if type == 'l':
+                    if last[(type, data)] != i:
+                        continue
+                elif (type, data) in seen:
+                    continue
+                seen.add((type, data))
+                kept.append((type, data, merged))
+            fragments = kept
+
+        result = []
+        for type, data, merged in fragments:
+            if not as_args:
+                result.append((type, data))
+            elif type:
+                result.append(sys.intern(f'-{type}{data}'))
+            elif merged:
+                # merged fragments, like "-framework Foo", hold two arguments
+                result.extend(sys.intern(a) for a in data.split(' ', 1))
+            else:
+                result.append(data)
+        if self._profile is not None:
+            self._profile.render_time += time.perf_counter() - start
+        return tuple(result)
+
+    def cflags(self, packages: T.Union[str, T.List[str]], filter: T.Optional[FragmentFilter] = None,
+               **kwargs) -> T.Optional[str]:
+        """Cflags of the packages, filtered by `filter`, or else by the
+        CflagFilterData options given as keyword arguments.
+        """
+        flt = _check_filter('cflags', filter, kwargs)
+        if isinstance(packages, str):
+            packages = [packages]
+        if self._memoizing:
+            return self.__memoized(('cflags', tuple(p for p in packages if p), flt), self._cflags, packages, flt)
+        return self._cflags(packages, flt)
+
+    def _cflags(self, packages: T.List[str], flt: FragmentFilter) -> T.Optional[str]:
+        with self._solve(packages) as world:
+            if not world:
+                return None
+            return self._render_cflags(world, flt)
+
+    def libs(self, packages: T.Union[str, T.List[str]], filter: T.Optional[FragmentFilter] = None,
+             **kwargs) -> T.Optional[str]:
+        """Libs of the packages, filtered by `filter`, or else by the
+        LibsFilterData options given as keyword arguments.
+        """
+        flt = _check_filter('libs', filter, kwargs)
+        if isinstance(packages, str):
+            packages = [packages]
+        if self._memoizing:
+            return self.__memoized(('libs', tuple(p for p in packages if p), flt), self._libs, packages, flt)
+        return self._libs(packages, flt)
 
-    def libs(self, packages: T.Union[str, T.List[str]], **kwargs) -> T.Optional[str]:
+    def _libs(self, packages: T.List[str], flt: FragmentFilter) -> T.Optional[str]:
+        with self._solve(packages) as world:
+            if not world:
+                return None
+            return self._render_libs(world, flt)
+
+    def cflags_fragments(self, packages: T.Union[str, T.List[str]], as_args: bool = False,
+                         dedup: bool = False, filter: T.Optional[FragmentFilter] = None,
+                         **kwargs) -> T.Optional[Fragments]:
+        """Like cflags(), but without rendering to a single string.
+
+        Returns a tuple of (type, data) pairs, or of ready to use arguments
+        if as_args is True. Strings are interned. With dedup, only one
+        occurrence of a repeated fragment is kept: the last one for -l, so
+        the static link order is preserved, the first one for the others.
+        """
+        flt = _check_filter('cflags', filter, kwargs)
+        if isinstance(packages, str):
+            packages = [packages]
+        with self._solve(packages) as world:
+            if not world:
+                return None
+            with self._filtered_cflags(world, flt) as fragment_list:
+                return None if fragment_list is None else self._fragments(fragment_list, as_args, dedup)
+
+    def libs_fragments(self, packages: T.Union[str, T.List[str]], as_args: bool = False,
+                       dedup: bool = False, filter: T.Optional[FragmentFilter] = None,
+                       **kwargs) -> T.Optional[Fragments]:
+        """Like libs(), but without rendering to a single string. See cflags_fragments(). """
+        flt = _check_filter('libs', filter, kwargs)
         if isinstance(packages, str):
             packages = [packages]
         with self._solve(packages) as world:
             if not world:
                 return None
+            with self._filtered_libs(world, flt) as fragment_list:
+                return None if fragment_list is None else self._fragments(fragment_list, as_args, dedup)
+
+    def _requested_names(self, packages: T.List[str]) -> T.List[str]:
+        deplist = ffi.new('pkgconf_list_t *')
+        lib.pkgconf_dependency_parse_str(self._client, deplist, ' '.join(packages).encode(), 0)
+        names = [ffi.string(dep.package).decode() for dep in NodeIter(deplist, 'pkgconf_dependency_t *')]
+        lib.pkgconf_dependency_free(deplist)
+        return names
+
+    def query(self, packages: T.Union[str, T.List[str]],
+              want: T.Iterable[str] = ('modversion', 'cflags', 'libs'),
+              variables: T.Iterable[str] = (),
+              cflags_filter: T.Union[FragmentFilter, T.Dict[str, T.Any], None] = None,
+              libs_filter: T.Union[FragmentFilter, T.Dict[str, T.Any], None] = None) -> T.Optional[QueryResult]:
+        """Solve the dependency graph once and collect several results from it.
+
+        `want` is a subset of QUERY_FIELDS. Requested variables are looked up
+        in the requested packages only, like variable(). `libs_static` needs
+        a second solve, unless the client is already in static mode.
+        Returns None if the packages cannot be solved.
+        """
+        result, = self._query_batch([packages], want, variables, cflags_filter, libs_filter)
+        return None if isinstance(result, QueryError) else result
+
+    def batch_query(self, package_lists: T.Iterable[T.Union[str, T.List[str]]],
+                    want: T.Iterable[str] = ('modversion', 'cflags', 'libs'),
+                    variables: T.Iterable[str] = (),
+                    cflags_filter: T.Union[FragmentFilter, T.Dict[str, T.Any], None] = None,
+                    libs_filter: T.Union[FragmentFilter, T.Dict[str, T.Any], None] = None) -> T.List[T.Union[QueryResult, QueryError]]:
+        """Run query() for many independent package lists.
+
+        Parsed packages are kept for the whole batch, even if the client
+        cache is disabled, and filters are only built once. Results are in
+        input order; items that fail are reported as QueryError instances.
+        """
+        cache = self._cache
+        self._cache = True
+        try:
+            return self._query_batch(list(package_lists), want, variables, cflags_filter, libs_filter)
+        finally:
+            self._cache = cache
+
+    def _query_batch(self, package_lists: T.List[T.Union[str, T.List[str]]],
+                     want: T.Iterable[str],
+                     variables: T.Iterable[str],
+                     cflags_filter: T.Union[FragmentFilter, T.Dict[str, T.Any], None],
+                     libs_filter: T.Union[FragmentFilter, T.Dict[str, T.Any], None]) -> T.List[T.Union[QueryResult, QueryError]]:
+        want = set(want)
+        unknown = want.difference(QUERY_FIELDS)
+        if unknown:
+            raise ValueError(f'Unknown query fields: {", ".join(sorted(unknown))}')
+        variables = list(variables)
+        cflags_data = _check_filter('cflags', cflags_filter)
+        libs_data = _check_filter('libs', libs_filter)
+        static_libs_solve = 'libs_static' in want and not self._options.static
+
+        results = []
+        for packages in package_lists:
+            try:
+                if isinstance(packages, str):
+                    packages = [packages]
+                with self._solve(packages) as world:
+                    if not world:
+                        diagnostics = self._diagnostics
+                        raise QueryError(packages, '; '.join(map(str, diagnostics)) or 'could not solve packages',
+                                         diagnostics)
+                    results.append(self._query_world(world, packages, want, variables, cflags_data, libs_data))
+            except Exception as e:
+                results.append(e if isinstance(e, QueryError) else QueryError(packages, str(e)))
+
+        # All static solves are done together, after the others
+        if static_libs_solve:
+            with self.options_ctx(static=True):
+                for packages, result in zip(package_lists, results):
+                    if isinstance(result, QueryError):
+                        continue
+                    if isinstance(packages, str):
+                        packages = [packages]
+                    with self._solve(packages) as world:
+                        if world:
+                            result.libs_static = self._render_libs(world, libs_data)
+
+        return results
+
+    def _query_world(self, world, packages: T.List[str], want: T.Set[str], variables: T.List[str],
+                     cflags_data: FragmentFilter, libs_data: FragmentFilter) -> QueryResult:
+        result = QueryResult()
+
+        if 'modversion' in want or variables:
+            matches = {}
+            for pkg_dep in NodeIter(world.required, 'pkgconf_dependency_t *'):
+                matches.setdefault(ffi.string(pkg_dep.package).decode(), pkg_dep.match)
+            requested = [matches[n] for n in self._requested_names(packages) if n in matches]
+
+            if 'modversion' in want:
+                versions = [ffi.string(pkg.version).decode() for pkg in requested if pkg.version != ffi.NULL]
+                result.modversion = '\n'.join(versions) if versions else None
+
+            for name in variables:
+                found_vars = []
+                for pkg in requested:
+                    var = lib.pkgconf_tuple_find(self._client, ffi.addressof(pkg.vars), name.encode())
+                    if var != ffi.NULL:
+                        found_vars.append(ffi.string(var).decode())
+                result.variables[name] = ' '.join(found_vars) if found_vars else None
+
+        if 'cflags' in want:
+            result.cflags = self._render_cflags(world, cflags_data)
+        if 'libs' in want:
+            result.libs = self._render_libs(world, libs_data)
+        if 'libs_static' in want and self._options.static:
+            result.libs_static = self._render_libs(world, libs_data)
+
+        return result
+
+    def graph(self, packages: T.Union[str, T.List[str]], static: bool = False) -> T.Optional[DependencyGraph]:
+        """Dependency graph of the solved packages.
+
+        With static, Requires.private edges are part of the graph. When the
+        package cache is enabled, graphs are memoized until the cache is
+        invalidated. Returns None if the packages cannot be solved.
+        """
+        if isinstance(packages, str):
+            packages = [packages]
 
-            unfiltered_list = ffi.new('pkgconf_list_t *')
-            filtered_list = ffi.new('pkgconf_list_t *')
+        with self.options_ctx(static=static):
+            if self._cache:
+                self.__prepare_cache()
+                memo_key = (tuple(packages), self._options.flags, self._options.maximum_traverse_depth)
+                memo = self._graphs.get(memo_key)
+                if memo is not None and memo[0] == self._cache_key:
+                    return memo[1]
 
-            try:
-                eflag = lib.pkgconf_pkg_libs(self._client, world, unfiltered_list, 2)
-                if eflag != flags.ERRF_OK:
+            with self._solve(packages) as world:
+                if not world:
                     return None
-                
-                kwargs.setdefault('keep_system', os.environ.get('PKG_CONFIG_ALLOW_SYSTEM_LIBS', False))
-                data = ffi.new_handle(LibsFilterData(**kwargs))
-                lib.pkgconf_fragment_filter(self._client, filtered_list, unfiltered_list, lib.filter_libs, data)
-
-                result_str = lib.pkgconf_fragment_render(filtered_list, True, ffi.NULL)
-                return ffi.string(result_str).decode()
-            
-            finally:
-                lib.pkgconf_fragment_free(filtered_list)
-                lib.pkgconf_fragment_free(unfiltered_list)
+                graph = self.__build_graph(world, packages, static)
+
+            if self._cache:
+                self._graphs[memo_key] = (self._cache_key, graph)
+        return graph
+
+    def __build_graph(self, world, packages: T.List[str], static: bool) -> DependencyGraph:
+        nodes = []
+        nodes_handle = ffi.new_handle(nodes)
+        # the virtual world package is one more level above the requested packages
+        depth = self._options.maximum_traverse_depth
+        if depth > 0:
+            depth += 1
+        lib.pkgconf_pkg_traverse(self._client, world, lib.collect_graph_node, nodes_handle, depth, 0)
+        ids = {}
+        for pkg in nodes:
+            ids.setdefault(pkg, len(ids))
+        nodes = list(ids)
+
+        edge_source = array('i')
+        edge_target = array('i')
+        edge_compare = array('b')
+        edge_flags = array('I')
+        edge_version = []
+        for source, pkg in enumerate(nodes):
+            dep_lists = (pkg.required, pkg.requires_private) if static else (pkg.required,)
+            for deps in dep_lists:
+                for dep in NodeIter(deps, 'pkgconf_dependency_t *'):
+                    if dep.match not in ids:
+                        continue
+                    edge_source.append(source)
+                    edge_target.append(ids[dep.match])
+                    edge_compare.append(dep.compare)
+                    edge_flags.append(dep.flags)
+                    edge_version.append(_optional_string(dep.version))
+
+        matches = {}
+        for pkg_dep in NodeIter(world.required, 'pkgconf_dependency_t *'):
+            matches.setdefault(ffi.string(pkg_dep.package).decode(), pkg_dep.match)
+        roots = array('i', (ids[matches[n]] for n in self._requested_names(packages)
+                            if n in matches and matches[n] in ids))
+
+        return DependencyGraph(
+            names=tuple(ffi.string(pkg.id).decode() for pkg in nodes),
+            versions=tuple(_optional_string(pkg.version) for pkg in nodes),
+            provides=tuple(tuple(ffi.string(p.package).decode() for p in NodeIter(pkg.provides, 'pkgconf_dependency_t *'))
+                           for pkg in nodes),
+            roots=roots,
+            edge_source=edge_source,
+            edge_target=edge_target,
+            edge_compare=edge_compare,
+            edge_flags=edge_flags,
+            edge_version=tuple(edge_version),
+        )
+
+    def list_all(self, snapshot: T.Optional[str] = None) -> T.List[PackageInfo]:
+        """Index all the packages of the search path, like pkg-config --list-all.
+
+        When a package is found in several directories, the first one in
+        search order wins. If `snapshot` is the path of a file, the index is
+        saved there, and reused as long as the stat of the search
+        directories does not change.
+        """
+        dirs = {d: stat_key(d) for d in self._dir_key}
+        if snapshot:
+            try:
+                with open(snapshot, encoding='utf-8') as f:
+                    data = json.load(f)
+                if data['dirs'] == [[d, list(k) if k else None] for d, k in dirs.items()]:
+                    return [PackageInfo(*p) for p in data['packages']]
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+
+        packages: T.Dict[str, PackageInfo] = {}
+        self.__errors.clear()
+        try:
+            lib.pkgconf_scan_all(self._client, ffi.new_handle(packages), lib.collect_package_info)
+        finally:
+            self.__log_errors()
+        index = sorted(packages.values(), key=lambda p: p.id)
+
+        if snapshot:
+            data = {
+                'dirs': [[d, list(k) if k else None] for d, k in dirs.items()],
+                'packages': [[p.id, p.version, p.description, p.filename] for p in index],
+            }
+            tmp = f'{snapshot}.{os.getpid()}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp, snapshot)
+
+        return index
 
     def variable(self, package: str, variable_name: str) -> T.Optional[str]:
+        if self._memoizing:
+            return self.__memoized(('variable', package, variable_name), self._variable, package, variable_name)
+        return self._variable(package, variable_name)
+
+    def _variable(self, package: str, variable_name: str) -> T.Optional[str]:
         found_vars = []
 
         with self.options_ctx(skip_root_virtual=True):
@@ -363,8 +1992,94 @@ class PkgconfClient:
         return ' '.join(found_vars) if found_vars else None
 
     def list_variables(self, package: str) -> T.Optional[T.List[str]]:
+        if self._memoizing:
+            variables = self.__memoized(('list_variables', package), self._list_variables, package)
+            return list(variables) if variables is not None else None
+        return self._list_variables(package)
+
+    def _list_variables(self, package: str) -> T.Optional[T.List[str]]:
         variables = []
         for pkg in self._iter_world([package], maximum_traverse_depth=1): 
             for variable in NodeIter(pkg.vars):
                 variables.append(ffi.string(variable.key).decode())
         return variables or None
+
+
+def _fork_options(options: PkgconfFlags, overrides: T.Dict[str, T.Any]) -> PkgconfFlags:
+    unknown = set(overrides).difference(f.name for f in fields(PkgconfFlags))
+    if unknown:
+        raise TypeError(f'unknown options: {", ".join(sorted(unknown))}')
+    options = copy.copy(options)
+    options.update(**overrides)
+    return options
+
+
+class ClientFork:
+    """Variant of a PkgconfClient with more variables or other options.
+
+    A fork only holds its variables and options; see PkgconfClient.fork().
+    Its queries run on the client it was forked from when the variables
+    are the same, or else on a client shared by the forks with the same
+    variables, so packages are parsed once per set of variables, whatever
+    the options. Packages registered or a sysroot set on the parent client
+    later are seen by its forks.
+
+    Queries of forks running on the same client are serialized, the others
+    run concurrently. The parent client must not be queried directly from
+    another thread while its forks are in use.
+    """
+
+    def __init__(self, parent: PkgconfClient, variables: T.Dict[str, str], options: PkgconfFlags):
+        self._parent = parent
+        self._variables = variables
+        self._options = options
+        self._option_values = {f.name: getattr(options, f.name) for f in fields(PkgconfFlags)}
+        self._client = None
+
+    def fork(self, define_variables: T.Optional[T.Dict[str, str]] = None, **options) -> ClientFork:
+        return ClientFork(self._parent, {**self._variables, **(define_variables or {})},
+                          _fork_options(self._options, options))
+
+    def _call(self, name: str, *args, **kwargs):
+        client = self._client = self._parent._fork_client(self._variables, self._client)
+        with client._fork_lock, client.options_ctx(**self._option_values):
+            return getattr(client, name)(*args, **kwargs)
+
+    def modversion(self, *args, **kwargs):
+        return self._call('modversion', *args, **kwargs)
+
+    def cflags(self, *args, **kwargs):
+        return self._call('cflags', *args, **kwargs)
+
+    def libs(self, *args, **kwargs):
+        return self._call('libs', *args, **kwargs)
+
+    def cflags_fragments(self, *args, **kwargs):
+        return self._call('cflags_fragments', *args, **kwargs)
+
+    def libs_fragments(self, *args, **kwargs):
+        return self._call('libs_fragments', *args, **kwargs)
+
+    def variable(self, *args, **kwargs):
+        return self._call('variable', *args, **kwargs)
+
+    def list_variables(self, *args, **kwargs):
+        return self._call('list_variables', *args, **kwargs)
+
+    def query(self, *args, **kwargs):
+        return self._call('query', *args, **kwargs)
+
+    def batch_query(self, *args, **kwargs):
+        return self._call('batch_query', *args, **kwargs)
+
+    def graph(self, *args, **kwargs):
+        return self._call('graph', *args, **kwargs)
+
+    def package(self, *args, **kwargs):
+        return self._call('package', *args, **kwargs)
+
+    def solution(self, *args, **kwargs):
+        return self._call('solution', *args, **kwargs)
+
+    def check_constraints(self, *args, **kwargs):
+        return self._call('check_constraints', *args, **kwargs)
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+from .libpkgconf import PkgconfClient, QueryError, QueryResult
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pickle
+import typing as T
+
+
+Result = T.Union[QueryResult, QueryError]
+
+# Client of the current worker process, built by _init_worker
+_worker_client: T.Optional[PkgconfClient] = None
+
+
+def _init_worker(client_state: bytes) -> None:
+    global _worker_client
+    _worker_client = pickle.loads(client_state)
+
+
+def _resolve_chunk(indices: T.List[int], package_lists: T.List[T.Union[str, T.List[str]]],
+                   query_kwargs: T.Dict[str, T.Any]) -> T.List[T.Tuple[int, Result]]:
+    # batch_query keeps the parsed packages in the client cache, so the
+    # worker stays warm for the next chunks and the next batches.
+    results = _worker_client.batch_query(package_lists, **query_kwargs)
+    return list(zip(indices, results))
+
+
+class ParallelPkgconfResolver:
+    """Resolve large batches of queries using a pool of worker processes.
+
+    Each worker holds its own PkgconfClient, rebuilt from the pickled state
+    of `client` (or of a client created from `kwargs`), whose package cache
+    is kept between chunks and batches.
+    """
+
+    def __init__(self, client: T.Optional[PkgconfClient] = None, max_workers: T.Optional[int] = None,
+                 chunksize: int = 16, mp_context=None, **kwargs):
+        if client is None:
+            client = PkgconfClient(**kwargs)
+        self.chunksize = chunksize
+        self._executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context,
+                                             initializer=_init_worker, initargs=(pickle.dumps(client),))
+
+    def __enter__(self) -> ParallelPkgconfResolver:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._executor.shutdown()
+
+    def resolve_iter(self, package_lists: T.Iterable[T.Union[str, T.List[str]]],
+                     **query_kwargs) -> T.Iterator[T.Tuple[int, Result]]:
+        """Yield (index, result) pairs as soon as the workers complete them.
+
+        `query_kwargs` are passed to PkgconfClient.batch_query.
+        """
+        package_lists = list(package_lists)
+        futures = {}
+        for start in range(0, len(package_lists), self.chunksize):
+            indices = list(range(start, min(start + self.chunksize, len(package_lists))))
+            chunk = package_lists[start:start + self.chunksize]
+            futures[self._executor.submit(_resolve_chunk, indices, chunk, query_kwargs)] = (indices, chunk)
+
+        for future in as_completed(futures):
+            try:
+                yield from future.result()
+            except Exception as e:
+                for index, packages in zip(*futures[future]):
+                    yield index, QueryError(packages, str(e))
+
+    def resolve(self, package_lists: T.Iterable[T.Union[str, T.List[str]]],
+                **query_kwargs) -> T.List[Result]:
+        """Like PkgconfClient.batch_query, but spread over the worker processes """
+        package_lists = list(package_lists)
+        results: T.List[T.Optional[Result]] = [None] * len(package_lists)
+        for index, result in self.resolve_iter(package_lists, **query_kwargs):
+            results[index] = result
+        return results
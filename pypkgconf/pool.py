@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+from .libpkgconf import PkgconfClient
+
+from contextlib import contextmanager
+import pickle
+import queue
+import threading
+import typing as T
+
+
+class PkgconfClientPool:
+    """Thread-safe access to a set of identically configured clients.
+
+    A libpkgconf client must not be used by two threads at once. With a
+    `size`, at most `size` clients are created and each query checks one
+    out for its duration. Without a size, each thread gets its own client.
+
+    Clients are rebuilt from the pickled state of `client` (or of a client
+    created from `kwargs`, with the package cache enabled by default).
+    The GIL is released while libpkgconf solves and renders, so queries
+    running in different threads overlap.
+    """
+
+    def __init__(self, client: T.Optional[PkgconfClient] = None, size: T.Optional[int] = None, **kwargs):
+        if client is None:
+            kwargs.setdefault('cache', True)
+            client = PkgconfClient(**kwargs)
+        self._state = pickle.dumps(client)
+        self.size = size
+
+        self._lock = threading.Lock()
+        self._created = 0
+        self._idle: queue.LifoQueue[PkgconfClient] = queue.LifoQueue()
+        self._local = threading.local()
+
+    def _new_client(self) -> PkgconfClient:
+        return pickle.loads(self._state)
+
+    @contextmanager
+    def client(self, timeout: T.Optional[float] = None) -> T.Iterator[PkgconfClient]:
+        """Check out a client for the duration of the context.
+
+        The configuration of the client must not be changed while it is
+        checked out, since it goes back to the pool afterwards.
+        """
+        if self.size is None:
+            client = getattr(self._local, 'client', None)
+            if client is None:
+                client = self._local.client = self._new_client()
+            yield client
+            return
+
+        try:
+            client = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            client = self._new_client() if create else self._idle.get(timeout=timeout)
+
+        try:
+            yield client
+        finally:
+            self._idle.put(client)
+
+    def _call(self, name: str, *args, **kwargs):
+        with self.client() as client:
+            return getattr(client, name)(*args, **kwargs)
+
+    def modversion(self, *args, **kwargs):
+        return self._call('modversion', *args, **kwargs)
+
+    def cflags(self, *args, **kwargs):
+        return self._call('cflags', *args, **kwargs)
+
+    def libs(self, *args, **kwargs):
+        return self._call('libs', *args, **kwargs)
+
+    def cflags_fragments(self, *args, **kwargs):
+        return self._call('cflags_fragments', *args, **kwargs)
+
+    def libs_fragments(self, *args, **kwargs):
+        return self._call('libs_fragments', *args, **kwargs)
+
+    def variable(self, *args, **kwargs):
+        return self._call('variable', *args, **kwargs)
+
+    def list_variables(self, *args, **kwargs):
+        return self._call('list_variables', *args, **kwargs)
+
+    def query(self, *args, **kwargs):
+        return self._call('query', *args, **kwargs)
+
+    def batch_query(self, *args, **kwargs):
+        return self._call('batch_query', *args, **kwargs)
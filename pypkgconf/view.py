@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+from ._libpkgconf import ffi, lib
+from .graph import COMPARATORS
+
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass
+import typing as T
+
+
+def _string(s) -> T.Optional[str]:
+    return ffi.string(s).decode(errors='replace') if s != ffi.NULL else None
+
+
+@dataclass(frozen=True)
+class Dependency:
+    package: str
+    comparator: str
+    version: T.Optional[str]
+
+    def __str__(self) -> str:
+        return f'{self.package} {self.comparator} {self.version}' if self.version else self.package
+
+
+class _ListView(Sequence):
+    """Read-only sequence over a pkgconf_list_t of a pinned package.
+
+    Items are decoded when accessed; node pointers are only collected on
+    the first random access.
+    """
+
+    __slots__ = ('_view', '_list', '_nodes')
+
+    ctype = 'void *'
+
+    def __init__(self, view: PackageView, pkgconf_list):
+        self._view = view
+        self._list = pkgconf_list
+        self._nodes = None
+
+    def _decode(self, data):
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        return self._list.length
+
+    def __iter__(self):
+        node = self._list.head
+        while node != ffi.NULL:
+            yield self._decode(ffi.cast(self.ctype, node.data))
+            node = node.next
+
+    def __getitem__(self, index):
+        if self._nodes is None:
+            nodes = []
+            node = self._list.head
+            while node != ffi.NULL:
+                nodes.append(node.data)
+                node = node.next
+            self._nodes = nodes
+        if isinstance(index, slice):
+            return [self._decode(ffi.cast(self.ctype, data)) for data in self._nodes[index]]
+        return self._decode(ffi.cast(self.ctype, self._nodes[index]))
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({list(self)!r})'
+
+
+class _FragmentsView(_ListView):
+    __slots__ = ()
+    ctype = 'pkgconf_fragment_t *'
+
+    def _decode(self, frag) -> T.Tuple[str, str]:
+        return (frag.type.decode() if frag.type != b'\0' else '', _string(frag.data) or '')
+
+
+class _DependenciesView(_ListView):
+    __slots__ = ()
+    ctype = 'pkgconf_dependency_t *'
+
+    def _decode(self, dep) -> Dependency:
+        return Dependency(_string(dep.package), COMPARATORS[dep.compare], _string(dep.version))
+
+
+class _VariablesView(Mapping):
+    """Read-only mapping over the variables of a pinned package"""
+
+    __slots__ = ('_view', '_list')
+
+    def __init__(self, view: PackageView, pkgconf_list):
+        self._view = view
+        self._list = pkgconf_list
+
+    def __getitem__(self, key: str) -> str:
+        node = self._list.head
+        encoded = key.encode()
+        while node != ffi.NULL:
+            var = ffi.cast('pkgconf_tuple_t *', node.data)
+            if ffi.string(var.key) == encoded:
+                return _string(var.value) or ''
+            node = node.next
+        raise KeyError(key)
+
+    def __iter__(self):
+        node = self._list.head
+        while node != ffi.NULL:
+            yield _string(ffi.cast('pkgconf_tuple_t *', node.data).key)
+            node = node.next
+
+    def __len__(self) -> int:
+        return self._list.length
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({dict(self)!r})'
+
+
+class PackageView:
+    """Lazy, read-only view of a package solved by a PkgconfClient.
+
+    The package is pinned with pkgconf_pkg_ref while the view is alive, so
+    it stays valid after the solution or the package cache is freed.
+    Fields are only decoded when read.
+    """
+
+    __slots__ = ('_owner', '_pkg')
+
+    def __init__(self, owner, pkg):
+        # owner is the PkgconfClient, kept alive to unref the package
+        self._owner = owner
+        self._pkg = lib.pkgconf_pkg_ref(owner._client, pkg)
+
+    def __del__(self):
+        if getattr(self, '_pkg', None) is not None:
+            lib.pkgconf_pkg_unref(self._owner._client, self._pkg)
+            self._pkg = None
+
+    @property
+    def id(self) -> str:
+        return _string(self._pkg.id)
+
+    @property
+    def name(self) -> T.Optional[str]:
+        return _string(self._pkg.realname)
+
+    @property
+    def version(self) -> T.Optional[str]:
+        return _string(self._pkg.version)
+
+    @property
+    def description(self) -> T.Optional[str]:
+        return _string(self._pkg.description)
+
+    @property
+    def url(self) -> T.Optional[str]:
+        return _string(self._pkg.url)
+
+    @property
+    def filename(self) -> T.Optional[str]:
+        return _string(self._pkg.filename)
+
+    @property
+    def variables(self) -> T.Mapping[str, str]:
+        return _VariablesView(self, self._pkg.vars)
+
+    @property
+    def cflags(self) -> T.Sequence[T.Tuple[str, str]]:
+        return _FragmentsView(self, self._pkg.cflags)
+
+    @property
+    def cflags_private(self) -> T.Sequence[T.Tuple[str, str]]:
+        return _FragmentsView(self, self._pkg.cflags_private)
+
+    @property
+    def libs(self) -> T.Sequence[T.Tuple[str, str]]:
+        return _FragmentsView(self, self._pkg.libs)
+
+    @property
+    def libs_private(self) -> T.Sequence[T.Tuple[str, str]]:
+        return _FragmentsView(self, self._pkg.libs_private)
+
+    @property
+    def requires(self) -> T.Sequence[Dependency]:
+        return _DependenciesView(self, self._pkg.required)
+
+    @property
+    def requires_private(self) -> T.Sequence[Dependency]:
+        return _DependenciesView(self, self._pkg.requires_private)
+
+    @property
+    def conflicts(self) -> T.Sequence[Dependency]:
+        return _DependenciesView(self, self._pkg.conflicts)
+
+    @property
+    def provides(self) -> T.Sequence[Dependency]:
+        return _DependenciesView(self, self._pkg.provides)
+
+    def __repr__(self) -> str:
+        return f'<PackageView {self.id} {self.version}>'
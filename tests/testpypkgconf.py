@@ -1,7 +1,17 @@
-from pypkgconf import PkgconfClient
+from pypkgconf import AsyncPkgconfClient, CrossResolver, Diagnostic, FragmentFilter, PkgconfClient, PkgconfClientPool, ParallelPkgconfResolver, QueryError
 
+from concurrent.futures import ThreadPoolExecutor
+from pypkgconf.libpkgconf import CflagFilterData, LibsFilterData, SearchPath
+from pypkgconf import flags
+from pypkgconf.cross import Target
+
+import asyncio
+import gc
+import itertools
+import json
 import os
 import pickle
+import tempfile
 import unittest
 
 
@@ -38,6 +48,21 @@ class TestLibPkgConf(unittest.TestCase):
         with client.options_ctx(static=True):
             self.assertEqual('-lsimple -lm', client.libs('simple'))
 
+    def test_options_ctx_restore(self):
+        datapath = os.path.join(os.path.dirname(__file__), 'data', 'dependencies')
+        client = PkgconfClient(with_paths=[datapath])
+        client.set_options(maximum_traverse_depth=1)
+        client.variable('a_dep_c', 'prefix')
+        self.assertEqual(1, client._options.maximum_traverse_depth)
+        self.assertEqual(1, client.fork()._options.maximum_traverse_depth)
+        self.assertEqual('-la_dep_c', client.libs('a_dep_c'))
+
+        with self.assertRaises(RuntimeError):
+            with client.options_ctx(static=True), client.variables_ctx(prefix='/opt'):
+                raise RuntimeError
+        self.assertFalse(client._options.static)
+        self.assertEqual({}, client._variables)
+
     def test_simple_variable(self):
         client = PkgconfClient()
 
@@ -196,6 +221,718 @@ class TestLibPkgConf(unittest.TestCase):
         self.assertEqual('-lh_dep_k_i_j -lj_dep_k -li_dep_k_j -lk_dep', client.libs(['h_dep_k_i_j', 'i_dep_k_j']))
         self.assertEqual('-lh_dep_k_i_j -li_dep_k_j -lj_dep_k -lk_dep', client.libs(['k_dep', 'j_dep_k', 'i_dep_k_j', 'h_dep_k_i_j']))
 
+    def test_cache_hits(self):
+        client = PkgconfClient(cache=True)
+
+        self.assertEqual('-lsimple', client.libs('simple'))
+        stats = client.cache_stats()
+        self.assertEqual(0, stats.hits)
+        self.assertEqual(1, stats.misses)
+
+        self.assertEqual('-lsimple', client.libs('simple'))
+        self.assertEqual('1.0.0', client.modversion('simple'))
+        stats = client.cache_stats()
+        self.assertEqual(2, stats.hits)
+        self.assertEqual(1, stats.misses)
+        self.assertEqual(1, stats.size)
+
+    def test_cache_invalidation(self):
+        client = PkgconfClient(cache=True)
+
+        self.assertEqual('-I/usr/include', client.cflags('simple', keep_system=True))
+        client.define_variables(prefix='/opt')
+        self.assertEqual('-I/opt/include', client.cflags('simple', keep_system=True))
+        client.define_variables(prefix='/opt')
+        self.assertEqual('-I/opt/include', client.cflags('simple', keep_system=True))
+
+        stats = client.cache_stats()
+        self.assertEqual(1, stats.hits)
+        self.assertEqual(2, stats.misses)
+
+    def test_cache_disabled(self):
+        client = PkgconfClient()
+
+        self.assertEqual('-lsimple', client.libs('simple'))
+        self.assertEqual('-lsimple', client.libs('simple'))
+        self.assertEqual(0, client.cache_stats().hits)
+
+    def test_query(self):
+        client = PkgconfClient()
+
+        result = client.query('simple', want=('modversion', 'cflags', 'libs', 'libs_static'),
+                              variables=('prefix', 'nonexistent'), cflags_filter={'keep_system': True})
+        self.assertEqual('1.0.0', result.modversion)
+        self.assertEqual('-I/usr/include', result.cflags)
+        self.assertEqual('-lsimple', result.libs)
+        self.assertEqual('-lsimple -lm', result.libs_static)
+        self.assertEqual({'prefix': '/usr', 'nonexistent': None}, result.variables)
+
+    def test_query_filters(self):
+        client = PkgconfClient()
+
+        result = client.query('other', want=('cflags', 'libs'),
+                              cflags_filter={'only_I': True}, libs_filter={'only_libname': True})
+        self.assertIsNone(result.modversion)
+        self.assertEqual('-I/other/include', result.cflags)
+        self.assertEqual('-lother', result.libs)
+
+    def test_query_nonexistent(self):
+        client = PkgconfClient()
+
+        self.assertIsNone(client.query('nonexistent'))
+        with self.assertRaises(ValueError):
+            client.query('simple', want=('version',))
+
+    def test_libs_predicate(self):
+        client = PkgconfClient()
+
+        self.assertEqual('-L/other/lib -lother', client.libs('other', predicate=lambda t, d: t in 'Ll'))
+        self.assertEqual('-lother', client.libs('other', only_libname=True, predicate=lambda t, d: True))
+
+    def test_filter_type_mask(self):
+        for cls, options in ((CflagFilterData, ('only_I', 'only_other')),
+                             (LibsFilterData, ('only_ldpath', 'only_libname', 'only_other'))):
+            for values in itertools.product((False, True), repeat=len(options)):
+                for fragment_filter in (None, 'I', 'Ll', 'DW'):
+                    data = cls(fragment_filter=fragment_filter, **dict(zip(options, values)))
+                    mask = data.type_mask()
+                    for t in range(256):
+                        self.assertEqual(data.filter(chr(t)), bool(mask[t]))
+
+    def test_fragment_filter(self):
+        client = PkgconfClient()
+
+        only_libname = FragmentFilter.libs(only_libname=True)
+        self.assertIs(only_libname, FragmentFilter.libs(only_libname=True))
+        self.assertEqual(only_libname, pickle.loads(pickle.dumps(only_libname)))
+        self.assertNotEqual(only_libname, FragmentFilter.libs())
+
+        self.assertEqual('-lother', client.libs('other', filter=only_libname))
+        self.assertEqual((('l', 'other'),), client.libs_fragments('other', filter=only_libname))
+        self.assertEqual('-I/usr/include', client.cflags('simple', filter=FragmentFilter.cflags(keep_system=True)))
+
+        result = client.query('other', cflags_filter=FragmentFilter.cflags(only_I=True), libs_filter=only_libname)
+        self.assertEqual('-I/other/include', result.cflags)
+        self.assertEqual('-lother', result.libs)
+
+        with self.assertRaises(ValueError):
+            client.cflags('other', filter=only_libname)
+        with self.assertRaises(ValueError):
+            client.libs('other', filter=only_libname, only_ldpath=True)
+        with self.assertRaises(AttributeError):
+            only_libname.keep_system = True
+
+    def test_cflags_fragments(self):
+        client = PkgconfClient()
+
+        self.assertEqual((('I', '/other/include'), ('D', 'OTHER')), client.cflags_fragments('other'))
+        self.assertEqual(('-I/other/include',), client.cflags_fragments('other', as_args=True, only_I=True))
+        self.assertIsNone(client.cflags_fragments('nonexistent'))
+
+    def test_libs_fragments(self):
+        client = PkgconfClient()
+
+        self.assertEqual(('-L/other/lib', '-Wl,--as-needed', '-lother'), client.libs_fragments('other', as_args=True))
+        self.assertEqual((('l', 'other'),), client.libs_fragments('other', only_libname=True))
+
+    def test_libs_fragments_dedup(self):
+        client = PkgconfClient()
+
+        with client.options_ctx(static=True):
+            libs = client.libs_fragments(['simple', 'other'], as_args=True, dedup=True)
+        self.assertEqual(len(libs), len(set(libs)))
+        self.assertIn('-lsimple', libs)
+        self.assertIn('-lm', libs)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for name, libs, requires in (('dedup_x', '-L/opt/lib -ldedup_x -lz', 'dedup_y'),
+                                         ('dedup_y', '-L/opt/lib -ldedup_y -lz', '')):
+                with open(os.path.join(tmpdir, f'{name}.pc'), 'w') as f:
+                    f.write(f'Name: {name}\nDescription: test\nVersion: 1.0\nLibs: {libs}\n'
+                            f'Requires.private: {requires}\n')
+            client = PkgconfClient(with_paths=[tmpdir], static=True)
+            self.assertEqual(('-L/opt/lib', '-ldedup_x', '-ldedup_y', '-lz'),
+                             client.libs_fragments('dedup_x', as_args=True, dedup=True))
+
+    def test_batch_query(self):
+        datapath = os.path.join(os.path.dirname(__file__), 'data', 'dependencies')
+        client = PkgconfClient(with_paths=[datapath])
+
+        results = client.batch_query([['a_dep_c', 'b_dep_c'], 'nonexistent', 'simple', ['c_dep']],
+                                     want=('modversion', 'libs', 'libs_static'))
+        self.assertEqual(4, len(results))
+        self.assertEqual(client.libs(['a_dep_c', 'b_dep_c']), results[0].libs)
+        self.assertIsInstance(results[1], QueryError)
+        self.assertEqual(['nonexistent'], results[1].packages)
+        self.assertEqual('1.0.0', results[2].modversion)
+        self.assertEqual('-lsimple', results[2].libs)
+        self.assertEqual('-lsimple -lm', results[2].libs_static)
+        self.assertEqual('-lc_dep', results[3].libs)
+
+        with self.assertLogs('pypkgconf', 'ERROR') as logs:
+            self.assertIsInstance(client.batch_query(['nonexistent'])[0], QueryError)
+        self.assertIn('nonexistent', '\n'.join(logs.output))
+        # logged messages are not carried over to the next call
+        self.assertEqual(0, len(client._PkgconfClient__errors))
+        with self.assertNoLogs('pypkgconf', 'ERROR'):
+            client.list_all()
+            client.check_constraints(['nonexistent'])
+
+    def test_parallel_resolver(self):
+        datapath = os.path.join(os.path.dirname(__file__), 'data', 'dependencies')
+        client = PkgconfClient(with_paths=[datapath])
+        package_lists = [['a_dep_c', 'b_dep_c'], 'nonexistent', 'd_dep_e_f', 'simple'] * 4
+
+        with ParallelPkgconfResolver(client, max_workers=2, chunksize=3) as resolver:
+            results = resolver.resolve(package_lists, want=('libs',))
+            streamed = dict(resolver.resolve_iter(package_lists, want=('libs',)))
+
+        self.assertEqual(len(package_lists), len(results))
+        for i, packages in enumerate(package_lists):
+            if packages == 'nonexistent':
+                self.assertIsInstance(results[i], QueryError)
+            else:
+                self.assertEqual(client.libs(packages), results[i].libs)
+            self.assertEqual(results[i].__class__, streamed[i].__class__)
+
+    def _check_pool(self, pool):
+        packages = ['simple', 'other', 'system', 'nonexistent'] * 25
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(pool.libs, packages))
+
+        client = PkgconfClient()
+        self.assertEqual([client.libs(p) for p in packages], results)
+
+    def test_client_pool(self):
+        pool = PkgconfClientPool(size=2)
+        self._check_pool(pool)
+        self.assertLessEqual(pool._created, 2)
+
+    def test_client_pool_per_thread(self):
+        self._check_pool(PkgconfClientPool())
+
+    def test_async_client(self):
+        async def run():
+            async with AsyncPkgconfClient(max_workers=2, max_concurrency=3) as client:
+                results = await asyncio.gather(
+                    client.modversion('simple'),
+                    client.cflags('other', only_I=True),
+                    client.libs('other', only_libname=True),
+                    client.list_variables('no-variables'),
+                    client.libs('nonexistent'),
+                )
+                batch = await client.batch_query(['simple', 'nonexistent', 'other'], chunksize=2, want=('libs',))
+                return results, batch
+
+        results, batch = asyncio.run(run())
+        self.assertEqual(['1.0.0', '-I/other/include', '-lother', ['pcfiledir'], None], results)
+        self.assertEqual('-lsimple', batch[0].libs)
+        self.assertIsInstance(batch[1], QueryError)
+        self.assertEqual('-L/other/lib -Wl,--as-needed -lother', batch[2].libs)
+
+    def _write_pc(self, path, name, requires='', cflags=''):
+        with open(os.path.join(path, f'{name}.pc'), 'w') as f:
+            f.write(f'Name: {name}\nDescription: test\nVersion: 1.0.0\n'
+                    f'Requires: {requires}\nLibs: -l{name}\nCflags: {cflags}\n')
+
+    def test_cache_validation(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self._write_pc(tmpdir, 'stat_a', 'stat_c')
+            self._write_pc(tmpdir, 'stat_b', 'stat_c')
+            self._write_pc(tmpdir, 'stat_c')
+            client = PkgconfClient(with_paths=[tmpdir], cache=True, validate_cache=True)
+
+            self.assertEqual('-lstat_a -lstat_c', client.libs('stat_a'))
+            self.assertEqual('-lstat_b -lstat_c', client.libs('stat_b'))
+            self.assertEqual(3, client.cache_stats().size)
+            self.assertEqual(0, client.refresh_cache())
+
+            # stat_c changes: stat_a and stat_b depend on it and are stale too
+            with open(os.path.join(tmpdir, 'stat_c.pc'), 'a') as f:
+                f.write('Cflags: -DCHANGED\n')
+            self.assertEqual('-DCHANGED', client.cflags('stat_a'))
+            self.assertEqual(5, client.cache_stats().misses)
+            self.assertEqual('-lstat_b -lstat_c', client.libs('stat_b'))
+
+            # removing a file changes the directory
+            os.unlink(os.path.join(tmpdir, 'stat_b.pc'))
+            self.assertIsNone(client.libs('stat_b'))
+            self.assertEqual('1.0.0', client.modversion('stat_c'))
+
+    def test_disk_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir, tempfile.TemporaryDirectory() as cachedir:
+            self._write_pc(tmpdir, 'disk_a', 'disk_b')
+            self._write_pc(tmpdir, 'disk_b')
+
+            client = PkgconfClient(with_paths=[tmpdir], disk_cache=cachedir)
+            self.assertEqual('-ldisk_a -ldisk_b', client.libs('disk_a'))
+            self.assertEqual('', client.cflags('disk_a'))
+            self.assertIsNone(client.libs('disk_nonexistent'))
+
+            # a new client gets the results without solving
+            client = PkgconfClient(with_paths=[tmpdir], disk_cache=cachedir, profile=True)
+            self.assertEqual('-ldisk_a -ldisk_b', client.libs('disk_a'))
+            self.assertIsNone(client.libs('disk_nonexistent'))
+            self.assertEqual('-ldisk_a', client.libs('disk_a', only_libname=True, predicate=lambda t, d: 'a' in d))
+            self.assertEqual(1, client.stats().queries)
+
+            # a dependency changes
+            self._write_pc(tmpdir, 'disk_b', cflags='-DCHANGED')
+            client = PkgconfClient(with_paths=[tmpdir], disk_cache=cachedir)
+            self.assertEqual('-DCHANGED', client.cflags('disk_a'))
+
+            # a failure is cached until the rejected package changes
+            self.assertIsNone(client.libs('disk_b >= 2.0'))
+            with open(os.path.join(tmpdir, 'disk_b.pc'), 'r+') as f:
+                content = f.read().replace('Version: 1.0.0', 'Version: 2.0.0')
+                f.seek(0)
+                f.write(content)
+            client = PkgconfClient(with_paths=[tmpdir], disk_cache=cachedir)
+            self.assertEqual('-ldisk_b', client.libs('disk_b >= 2.0'))
+
+    def test_list_all(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self._write_pc(tmpdir, 'index_a')
+            self._write_pc(tmpdir, 'index_b', 'index_a')
+            client = PkgconfClient(with_paths=[tmpdir])
+
+            index = {p.id: p for p in client.list_all()}
+            self.assertEqual('1.0.0', index['index_a'].version)
+            self.assertEqual(os.path.join(tmpdir, 'index_b.pc'), index['index_b'].filename)
+            self.assertEqual('Dummy pkgconfig test package for testing pkgconfig', index['simple'].description)
+
+            with tempfile.TemporaryDirectory() as snapshot_dir:
+                snapshot = os.path.join(snapshot_dir, 'index.json')
+                self.assertEqual(client.list_all(), client.list_all(snapshot=snapshot))
+
+                # the snapshot is reused while the directories do not change
+                with open(snapshot) as f:
+                    data = json.load(f)
+                for p in data['packages']:
+                    p[1] = '9.9'
+                with open(snapshot, 'w') as f:
+                    json.dump(data, f)
+                self.assertEqual({'9.9'}, {p.version for p in client.list_all(snapshot=snapshot)})
+
+                os.unlink(os.path.join(tmpdir, 'index_b.pc'))
+                index = {p.id: p for p in client.list_all(snapshot=snapshot)}
+                self.assertNotIn('index_b', index)
+                self.assertEqual('1.0.0', index['index_a'].version)
+
+    def test_graph(self):
+        datapath = os.path.join(os.path.dirname(__file__), 'data', 'dependencies')
+        client = PkgconfClient(with_paths=[datapath])
+
+        graph = client.graph('h_dep_k_i_j')
+        self.assertEqual({'h_dep_k_i_j', 'i_dep_k_j', 'j_dep_k', 'k_dep'}, set(graph.names))
+        self.assertEqual([graph.node('h_dep_k_i_j')], list(graph.roots))
+        self.assertEqual({'i_dep_k_j', 'j_dep_k', 'k_dep'},
+                         {graph.names[n] for n in graph.dependencies(graph.node('h_dep_k_i_j'))})
+        self.assertEqual({'h_dep_k_i_j', 'i_dep_k_j', 'j_dep_k'},
+                         {graph.names[n] for n in graph.reverse_dependencies(graph.node('k_dep'))})
+
+        order = [graph.names[n] for n in graph.topological_order()]
+        self.assertEqual(['k_dep', 'j_dep_k', 'i_dep_k_j', 'h_dep_k_i_j'], order)
+        self.assertFalse(any(graph.is_private(e) for e in range(len(graph.edge_source))))
+
+        # graphs are hashable, and their arrays read-only
+        self.assertIn(graph, {graph})
+        with self.assertRaises(TypeError):
+            graph.roots[0] = 1
+        clone = pickle.loads(pickle.dumps(graph))
+        self.assertEqual(graph.names, clone.names)
+        self.assertEqual(list(graph.edge_target), list(clone.edge_target))
+
+        self.assertIsNone(client.graph('nonexistent'))
+
+    def test_graph_memoized(self):
+        datapath = os.path.join(os.path.dirname(__file__), 'data', 'dependencies')
+        client = PkgconfClient(with_paths=[datapath], cache=True)
+
+        graph = client.graph(['a_dep_c', 'b_dep_c'])
+        self.assertIs(graph, client.graph(['a_dep_c', 'b_dep_c']))
+        self.assertEqual({'a_dep_c', 'b_dep_c'}, {graph.names[n] for n in graph.roots})
+        self.assertIsNot(graph, client.graph(['a_dep_c', 'b_dep_c'], static=True))
+
+        client.define_variables(prefix='/other')
+        self.assertIsNot(graph, client.graph(['a_dep_c', 'b_dep_c']))
+
+    def test_graph_traverse_depth(self):
+        datapath = os.path.join(os.path.dirname(__file__), 'data', 'dependencies')
+        client = PkgconfClient(with_paths=[datapath], cache=True)
+        self.assertEqual(('a_dep_c', 'c_dep'), client.graph('a_dep_c').names)
+
+        client.set_options(maximum_traverse_depth=1)
+        self.assertEqual('-la_dep_c', client.libs('a_dep_c'))
+        self.assertEqual(('a_dep_c',), client.graph('a_dep_c').names)
+
+    def test_graph_static(self):
+        client = PkgconfClient()
+
+        self.assertEqual(('simple',), client.graph('simple', static=True).names)
+
+    def test_profiling(self):
+        client = PkgconfClient(cache=True)
+        self.assertIsNone(client.stats())
+
+        client.enable_profiling()
+        self.assertEqual('-lother', client.libs('other', predicate=lambda t, d: t == 'l'))
+        self.assertEqual('-lother', client.libs('other', only_libname=True))
+        self.assertIsNone(client.libs('nonexistent'))
+
+        stats = client.stats()
+        self.assertEqual(3, stats.queries)
+        self.assertEqual(1, stats.packages_loaded)
+        self.assertEqual(1, stats.cache_hits)
+        self.assertEqual(6, stats.fragments_collected)
+        self.assertEqual(4, stats.fragments_filtered)
+        # the predicate runs for -L/other/lib, -Wl,--as-needed and -lother
+        self.assertEqual(3, stats.callbacks)
+        self.assertGreater(stats.solve_time, 0)
+        self.assertGreater(stats.render_time, 0)
+
+        first, second, missing = stats.recent
+        self.assertEqual(('other',), first.packages)
+        self.assertEqual('other.pc', os.path.basename(first.files[0]))
+        self.assertEqual((), second.files)
+        self.assertTrue(any(line.startswith('other') for line in first.audit))
+        self.assertTrue(any('NOT-FOUND' in line for line in missing.audit))
+
+        client.reset_stats()
+        self.assertEqual(0, client.stats().queries)
+
+        # only the fragments passing the type and system directory checks reach the predicate
+        self.assertEqual('-lother', client.libs('other', only_libname=True, predicate=lambda t, d: True))
+        self.assertEqual(1, client.stats().callbacks)
+        self.assertIsNotNone(pickle.loads(pickle.dumps(client)).stats())
+
+        client.disable_profiling()
+        self.assertIsNone(client.stats())
+
+    def test_memoize(self):
+        client = PkgconfClient(memoize=16)
+
+        self.assertEqual('-lsimple', client.libs('simple'))
+        self.assertEqual('-lsimple', client.libs(['simple']))
+        self.assertEqual('1.0.0', client.modversion('simple'))
+        self.assertEqual('-I/usr/include', client.cflags('simple', keep_system=True))
+        variables = client.list_variables('simple')
+        variables.append('modified')
+        self.assertNotIn('modified', client.list_variables('simple'))
+
+        stats = client.memo_stats()
+        self.assertEqual(2, stats.hits)
+        self.assertEqual(4, stats.misses)
+        self.assertAlmostEqual(1 / 3, stats.hit_rate)
+
+        with client.options_ctx(static=True):
+            self.assertEqual('-lsimple -lm', client.libs('simple'))
+        client.define_variables(prefix='/opt')
+        self.assertEqual('-I/opt/include', client.cflags('simple', keep_system=True))
+        self.assertEqual(2, client.memo_stats().hits)
+
+        self.assertIsNone(PkgconfClient().memo_stats())
+
+    def test_memoize_traverse_depth(self):
+        datapath = os.path.join(os.path.dirname(__file__), 'data', 'dependencies')
+        client = PkgconfClient(with_paths=[datapath], memoize=8)
+        self.assertEqual('-la_dep_c -lc_dep', client.libs('a_dep_c'))
+        client.set_options(maximum_traverse_depth=1)
+        self.assertEqual('-la_dep_c', client.libs('a_dep_c'))
+
+    def test_memoize_cache_validation(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self._write_pc(tmpdir, 'memo_a', 'memo_b')
+            self._write_pc(tmpdir, 'memo_b')
+            client = PkgconfClient(with_paths=[tmpdir], cache=True, validate_cache=True, memoize=8)
+            self.assertEqual('-lmemo_a -lmemo_b', client.libs('memo_a'))
+
+            with open(os.path.join(tmpdir, 'memo_b.pc'), 'a') as f:
+                f.write('Cflags: -DCHANGED\n')
+            self.assertEqual('-DCHANGED', client.cflags('memo_a'))
+
+            self._write_pc(tmpdir, 'memo_b', cflags='-DAGAIN')
+            self.assertEqual('-DAGAIN', client.cflags('memo_a'))
+            self.assertEqual(0, client.memo_stats().hits)
+
+    def test_memoize_ttl(self):
+        client = PkgconfClient(memoize=1, memoize_ttl=0)
+
+        self.assertEqual('1.0.0', client.modversion('simple'))
+        self.assertEqual('1.0.0', client.modversion('simple'))
+        stats = client.memo_stats()
+        self.assertEqual(0, stats.hits)
+        self.assertEqual(1, stats.size)
+
+    def test_package_view(self):
+        client = PkgconfClient(cache=True)
+
+        view = client.package('other')
+        client.clear_cache()
+        self.assertEqual('other', view.id)
+        self.assertEqual('1.0.0', view.version)
+        self.assertEqual('other.pc', os.path.basename(view.filename))
+        self.assertEqual('/other', view.variables['prefix'])
+        self.assertIn('libdir', view.variables)
+        with self.assertRaises(KeyError):
+            view.variables['nonexistent']
+        self.assertEqual(('I', '/other/include'), view.cflags[0])
+        self.assertEqual([('D', 'OTHER')], view.cflags[1:])
+        self.assertEqual(3, len(view.libs))
+        self.assertEqual([], list(view.requires))
+        self.assertIsNone(client.package('nonexistent'))
+
+    def test_solution_views(self):
+        datapath = os.path.join(os.path.dirname(__file__), 'data', 'dependencies')
+        client = PkgconfClient(with_paths=[datapath])
+
+        views = client.solution('a_dep_c')
+        self.assertEqual({'a_dep_c', 'c_dep'}, {v.id for v in views})
+        a_dep_c = next(v for v in views if v.id == 'a_dep_c')
+        self.assertEqual(['c_dep'], [str(d) for d in a_dep_c.requires])
+        self.assertIsNone(client.solution('nonexistent'))
+
+    def test_lazy_client(self):
+        datapath = os.path.join(os.path.dirname(__file__), 'data', 'dependencies')
+        client = PkgconfClient(with_paths=[datapath], define_variables={'prefix': '/opt'})
+        self.assertNotIn('_client', client.__dict__)
+        self.assertIs(client._search_path, PkgconfClient(with_paths=[datapath])._search_path)
+
+        clone = pickle.loads(pickle.dumps(client))
+        self.assertNotIn('_client', clone.__dict__)
+        self.assertIs(client._search_path, clone._search_path)
+        self.assertEqual('-I/opt/include', clone.cflags('simple', keep_system=True))
+        self.assertEqual('-lk_dep', clone.libs('k_dep'))
+
+    def test_with_paths_not_shared(self):
+        datapath = os.path.join(os.path.dirname(__file__), 'data', 'dependencies')
+        self.assertEqual('-lk_dep', PkgconfClient(with_paths=[datapath]).libs('k_dep'))
+        self.assertIsNone(PkgconfClient().libs('k_dep'))
+
+    def test_diagnostics(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self._write_pc(tmpdir, 'diag_old')
+            self._write_pc(tmpdir, 'diag_a', 'diag_old >= 2.0 diag_missing')
+            client = PkgconfClient(with_paths=[tmpdir])
+
+            self.assertIsNone(client.cflags('diag_a'))
+            diagnostics = client.diagnostics()
+            self.assertEqual({flags.ERRF_PACKAGE_VER_MISMATC, flags.ERRF_PACKAGE_NOT_FOUN},
+                             {d.code for d in diagnostics})
+            mismatch = next(d for d in diagnostics if d.code == flags.ERRF_PACKAGE_VER_MISMATC)
+            self.assertEqual(Diagnostic(flags.ERRF_PACKAGE_VER_MISMATC, 'diag_old', 'diag_old >= 2.0', 'diag_a', '1.0.0'),
+                             mismatch)
+
+            result = client.batch_query(['diag_a'], want=('cflags',))[0]
+            self.assertIsInstance(result, QueryError)
+            self.assertEqual(diagnostics, result.diagnostics)
+            self.assertIn("Package 'diag_missing', required by 'diag_a' not found", result.message)
+            self.assertEqual(diagnostics, pickle.loads(pickle.dumps(result)).diagnostics)
+
+            self.assertEqual('', client.cflags('diag_old'))
+            self.assertEqual((), client.diagnostics())
+
+    def test_check_constraints(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self._write_pc(tmpdir, 'cons_a')
+            client = PkgconfClient(with_paths=[tmpdir])
+
+            checks = client.check_constraints(['cons_a >= 1.0', 'cons_a > 1.0.0', ('cons_a', '=', '1.0.0'),
+                                               ('cons_a', '!=', '1.0'), ('cons_a',), 'cons_a < 0.9',
+                                               'cons_missing >= 1'])
+            self.assertEqual([1, 0, 1, 1, 1, 0, -1], list(checks.results))
+            self.assertEqual({'cons_a': '1.0.0', 'cons_missing': None}, checks.versions)
+            self.assertFalse(checks.satisfied())
+            self.assertEqual(['cons_a > 1.0.0', 'cons_a < 0.9', 'cons_missing >= 1'], checks.failed())
+            self.assertTrue(checks[0])
+
+            self.assertTrue(client.check_constraints([]).satisfied())
+            for constraint in (('cons_a', '~', '1.0'), ('cons_a', '>='), ('cons_a', '>=', ''), ()):
+                with self.assertRaises(ValueError) as cm:
+                    client.check_constraints(['cons_a', constraint])
+                self.assertIn(repr(constraint), str(cm.exception))
+
+    def test_search_path_release(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = PkgconfClient(with_paths=[tmpdir])
+            self.assertIs(client._search_path, PkgconfClient(with_paths=[tmpdir])._search_path)
+            self.assertIsNone(client.modversion('nonexistent'))
+            del client
+            gc.collect()
+            self.assertNotIn(((tmpdir,), None), SearchPath._instances)
+
+    def test_cross_resolver(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dirs = {}
+            for name in ('common', 'arm', 'x86'):
+                dirs[name] = os.path.join(tmpdir, name)
+                os.mkdir(dirs[name])
+            self._write_pc(dirs['common'], 'cross_base', cflags='-DBASE')
+            self._write_pc(dirs['common'], 'cross_top', 'cross_base')
+            self._write_pc(dirs['arm'], 'cross_arch', cflags='-DARM')
+            self._write_pc(dirs['x86'], 'cross_arch', cflags='-DX86')
+
+            resolver = CrossResolver([Target('arm', with_paths=(dirs['common'], dirs['arm'])),
+                                      Target('x86', with_paths=(dirs['common'], dirs['x86'])),
+                                      Target('other', personality='pypkgconf-none-test',
+                                             with_paths=(dirs['common'],), sysroot='/sysroot')])
+
+            results = resolver.query('cross_top', want=('cflags',))
+            self.assertEqual({'arm': '-DBASE', 'x86': '-DBASE', 'other': '-DBASE'},
+                             {name: r.cflags for name, r in results.items()})
+            self.assertEqual(2, resolver.stats().solves)
+            self.assertEqual(1, resolver.stats().shared)
+
+            results = resolver.query('cross_arch', want=('cflags',))
+            self.assertEqual('-DARM', results['arm'].cflags)
+            self.assertEqual('-DX86', results['x86'].cflags)
+            self.assertIsInstance(results['other'], QueryError)
+            self.assertEqual(1, resolver.stats().shared)
+
+            with self.assertRaises(ValueError):
+                CrossResolver(['same', 'same'])
+
+    def test_personality(self):
+        for triplet in ('bad triplet', 'a/b'):
+            with self.assertRaises(ValueError):
+                PkgconfClient(personality=triplet)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self._write_pc(tmpdir, 'personality_pkg')
+            path = os.path.join(tmpdir, 'test.personality')
+            with open(path, 'w') as f:
+                f.write(f'Triplet: test\nSysrootDir: /sysroot\nDefaultSearchPaths: {tmpdir}\n')
+            client = PkgconfClient(personality=path)
+            self.assertEqual('/sysroot', client._search_path.sysroot)
+            self.assertEqual('1.0.0', client.modversion('personality_pkg'))
+            # the personality loaded from the file is freed with its search path
+            del client
+            gc.collect()
+            self.assertNotIn(((), path), SearchPath._instances)
+
+    def test_register_package(self):
+        datapath = os.path.join(os.path.dirname(__file__), 'data', 'dependencies')
+        for cache in (False, True):
+            client = PkgconfClient(with_paths=[datapath], cache=cache, define_variables={'prefix': '/opt'})
+            client.register_package('mem_base', 'prefix=/mem\nName: mem_base\nDescription: in memory\n'
+                                                'Version: 2.0\nLibs: -L${prefix}/lib -lmem_base\n')
+            client.register_package('mem_top', {'Version': '1.0', 'Requires': ['mem_base >= 2', 'k_dep'],
+                                                'variables': {'answer': '42'}, 'Cflags': '-DMEM_TOP'})
+
+            self.assertEqual(['mem_base', 'mem_top'], client.registered_packages())
+            self.assertEqual('2.0', client.modversion('mem_base'))
+            self.assertEqual('-DMEM_TOP', client.cflags('mem_top'))
+            self.assertEqual('-L/opt/lib -lmem_base -lk_dep', client.libs('mem_top'))
+            self.assertEqual('-L/opt/lib -lmem_base -lk_dep', client.libs('mem_top'))
+
+            # parsed again when the variables change
+            client.define_variables(prefix='/other')
+            self.assertEqual('-L/other/lib -lmem_base -lk_dep', client.libs('mem_top'))
+
+            client.register_package('mem_base', {'Version': '1.0'})
+            self.assertIsNone(client.libs('mem_top'))
+            client.unregister_package('mem_base')
+            self.assertIsNone(client.modversion('mem_base'))
+
+            clone = pickle.loads(pickle.dumps(client))
+            self.assertEqual(['mem_top'], clone.registered_packages())
+            self.assertEqual('1.0', clone.modversion('mem_top'))
+
+        with self.assertRaises(ValueError):
+            client.register_package('mem_invalid', 'Name: mem_invalid\n')
+        with self.assertRaises(KeyError):
+            client.unregister_package('mem_invalid')
+
+        client = PkgconfClient(cache=True)
+        client.register_packages({f'mem_{i}': {'Version': str(i), 'Libs': f'-lmem_{i}'} for i in range(50)})
+        self.assertEqual('-lmem_7', client.libs('mem_7'))
+        with self.assertRaises(ValueError):
+            client.register_packages({'mem_new': {'Version': '1.0'}, 'mem_invalid': 'Name: mem_invalid\n'})
+        self.assertEqual(50, len(client.registered_packages()))
+
+        # the same packages registered in another order have the same digest
+        other = PkgconfClient()
+        other.register_packages({f'mem_{i}': {'Version': str(i), 'Libs': f'-lmem_{i}'} for i in reversed(range(50))})
+        self.assertEqual(client._registry_digest, other._registry_digest)
+        other.unregister_package('mem_7')
+        self.assertNotEqual(client._registry_digest, other._registry_digest)
+
+    def test_package_index(self):
+        datapath = os.path.join(os.path.dirname(__file__), 'data', 'dependencies')
+        for cache in (False, True):
+            plain = PkgconfClient(with_paths=[datapath], cache=cache)
+            indexed = PkgconfClient(with_paths=[datapath], cache=cache, index=True, trace=1000)
+            for name in ('a_dep_c', 'h_dep_k_i_j', 'd_dep_e_f'):
+                self.assertEqual(plain.libs(name), indexed.libs(name))
+                self.assertEqual(plain.cflags(name), indexed.cflags(name))
+            self.assertFalse([line for line in indexed.trace() if 'trying path' in line])
+            self.assertIsNone(indexed.libs('nonexistent'))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = PkgconfClient(with_paths=[tmpdir], index=True)
+            self.assertIsNone(client.modversion('index_new'))
+            self._write_pc(tmpdir, 'index_new')
+            self.assertEqual('1.0.0', client.modversion('index_new'))
+
+    def test_fork(self):
+        datapath = os.path.join(os.path.dirname(__file__), 'data', 'dependencies')
+        client = PkgconfClient(with_paths=[datapath], cache=True, index=True)
+        client.register_package('forked', {'Version': '1.0', 'Libs': '-L${prefix}/lib -lforked',
+                                           'variables': {'prefix': '/usr'}})
+        self.assertEqual('-la_dep_c -lc_dep', client.libs('a_dep_c'))
+        misses = client.cache_stats().misses
+
+        # forks with the variables of the client share its parsed packages
+        static = client.fork(static=True, maximum_traverse_depth=1)
+        self.assertEqual('-lsimple -lm', static.libs('simple'))
+        self.assertEqual('-la_dep_c', static.libs('a_dep_c'))
+        self.assertEqual('-lsimple', client.libs('simple'))
+        self.assertEqual(2000, client._options.maximum_traverse_depth)
+        self.assertEqual(misses + 1, client.cache_stats().misses)
+
+        # forks with other variables share a client
+        opt = client.fork({'prefix': '/opt'})
+        opt_static = opt.fork(static=True)
+        self.assertEqual('-I/opt/include', opt.cflags('simple', keep_system=True))
+        misses = opt._client.cache_stats().misses
+        self.assertEqual('-lsimple -lm', opt_static.libs('simple'))
+        self.assertIs(opt._client, opt_static._client)
+        self.assertIs(client._index, opt._client._index)
+        self.assertEqual(misses, opt._client.cache_stats().misses)
+        self.assertEqual('-I/usr/include', client.cflags('simple', keep_system=True))
+
+        # packages registered later are seen by the forks
+        self.assertEqual('-L/opt/lib -lforked', opt.libs('forked'))
+        client.unregister_package('forked')
+        self.assertIsNone(opt.modversion('forked'))
+
+        with self.assertRaises(TypeError):
+            client.fork(nonexistent=True)
+
+        forks = [client.fork({'prefix': f'/opt/{i % 3}'}, static=bool(i % 2)) for i in range(12)]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda fork: fork.cflags('simple', keep_system=True), forks))
+        self.assertEqual([f'-I/opt/{i % 3}/include' for i in range(12)], results)
+
+        # changing solve options does not flush parsed packages
+        self.assertEqual('-lsimple', client.libs('simple'))
+        misses = client.cache_stats().misses
+        with client.options_ctx(static=True):
+            self.assertEqual('-lsimple -lm', client.libs('simple'))
+        self.assertEqual('-lsimple', client.libs('simple'))
+        self.assertEqual(misses, client.cache_stats().misses)
+
+    def test_trace_ring(self):
+        datapath = os.path.join(os.path.dirname(__file__), 'data', 'dependencies')
+        self.assertEqual([], PkgconfClient(with_paths=[datapath]).trace())
+
+        client = PkgconfClient(with_paths=[datapath], trace=8)
+        for _ in range(10):
+            client.libs('a_dep_c')
+        lines = client.trace()
+        self.assertEqual(8, len(lines))
+        self.assertTrue(all(lines))
+
 
 if __name__ == '__main__':
     unittest.main()